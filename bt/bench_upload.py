@@ -0,0 +1,49 @@
+# bt/bench_upload.py
+# Compare the default and the parallel upload engine on the same file
+#
+# Usage: python bench_upload.py <file> [connections ...]
+# Only the file parts are uploaded (save_file), nothing is posted to any chat.
+
+import os
+import sys
+import asyncio
+from time import time
+from pyrogram import Client
+from config import PyroConf
+from helpers.files import get_readable_file_size, get_readable_time
+from helpers.transfer import parallel_save_file
+
+async def run_benchmark(path: str, connection_counts: list):
+    file_size = os.path.getsize(path)
+    print(f"File: {path} ({get_readable_file_size(file_size)})")
+
+    async with Client(
+        "bench_bot",
+        api_id=PyroConf.API_ID,
+        api_hash=PyroConf.API_HASH,
+        bot_token=PyroConf.BOT_TOKEN,
+        in_memory=True,
+    ) as bot:
+        runs = [("default", lambda: bot.save_file(path))]
+        for connections in connection_counts:
+            runs.append(
+                (
+                    f"parallel x{connections}",
+                    lambda connections=connections: parallel_save_file(bot, path, connections),
+                )
+            )
+
+        for label, upload in runs:
+            start = time()
+            await upload()
+            elapsed = time() - start
+            speed = get_readable_file_size(file_size / elapsed if elapsed else 0)
+            print(f"{label:<14} {get_readable_time(elapsed):>8}  {speed}/s")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python bench_upload.py <file> [connections ...]")
+        sys.exit(1)
+
+    counts = [int(arg) for arg in sys.argv[2:]] or [PyroConf.UPLOAD_CONNECTIONS]
+    asyncio.run(run_benchmark(sys.argv[1], counts))
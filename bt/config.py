@@ -1,7 +1,7 @@
 # bt/config.py
 # Updated configuration with Telethon session support and cookies
 
-from os import getenv
+from os import getenv, cpu_count
 from time import time
 from dotenv import load_dotenv
 
@@ -29,4 +29,34 @@ class PyroConf(object):
     SESSION_STRING = getenv("SESSION_STRING")
     TELETHON_SESSION = getenv("TELETHON_SESSION")  # Add Telethon session support
     BOT_START_TIME = time()
-    COOKIES_FILE = "/home/user/kolo/bt/cookies.txt"  # Path for YouTube cookies
\ No newline at end of file
+    COOKIES_FILE = "/home/user/kolo/bt/cookies.txt"  # Path for YouTube cookies
+    BATCH_CONCURRENCY = max(1, int(getenv("BATCH_CONCURRENCY", "3")))  # Posts /bdl processes at once
+    BATCH_DELAY = float(getenv("BATCH_DELAY", "3"))  # Seconds each /bdl worker waits between posts
+    BATCH_PREFETCH = max(1, int(getenv("BATCH_PREFETCH", "2")))  # Downloaded posts waiting for upload
+    GROUP_CONCURRENCY = max(1, int(getenv("GROUP_CONCURRENCY", "3")))  # Media group items downloaded at once
+    DOWNLOAD_TRANSMISSIONS = max(1, int(getenv("DOWNLOAD_TRANSMISSIONS", str(BATCH_CONCURRENCY * GROUP_CONCURRENCY))))  # Telegram downloads the user client runs at once
+    UPLOAD_TRANSMISSIONS = max(1, int(getenv("UPLOAD_TRANSMISSIONS", str(max(BATCH_CONCURRENCY, GROUP_CONCURRENCY)))))  # Telegram uploads the bot runs at once
+    BATCH_DISK_BUDGET = int(float(getenv("BATCH_DISK_BUDGET_GB", "8")) * 1024**3)  # Max bytes staged by /bdl
+    COPY_MODE = getenv("COPY_MODE", "true").lower() == "true"  # Copy unprotected posts server-side
+    DOWNLOAD_ENGINE = getenv("DOWNLOAD_ENGINE", "default").lower()  # "default" or "parallel"
+    DOWNLOAD_CONNECTIONS = max(1, int(getenv("DOWNLOAD_CONNECTIONS", "4")))  # Connections used by the parallel engine
+    UPLOAD_ENGINE = getenv("UPLOAD_ENGINE", "default").lower()  # "default" or "parallel"
+    UPLOAD_CONNECTIONS = max(1, int(getenv("UPLOAD_CONNECTIONS", "4")))  # Connections used by the parallel engine
+    SPLIT_PART_SIZE = int(float(getenv("SPLIT_PART_SIZE_MB", "1950")) * 1024**2)  # Byte budget per split video part
+    STREAM_SPLIT = getenv("STREAM_SPLIT", "false").lower() == "true"  # Split >2GB videos while downloading
+    MEDIA_CPU_SLOTS = max(1, int(getenv("MEDIA_CPU_SLOTS", str((cpu_count() or 2) // 2))))  # Concurrent ffmpeg/ffprobe jobs
+    MEDIA_IO_SLOTS = max(1, int(getenv("MEDIA_IO_SLOTS", "2")))  # Concurrent full-file passes (splits, packet scans)
+    URL_DOWNLOAD_CONCURRENCY = max(1, int(getenv("URL_DOWNLOAD_CONCURRENCY", "2")))  # /l and /yl links downloading at once
+    URL_UPLOAD_CONCURRENCY = max(1, int(getenv("URL_UPLOAD_CONCURRENCY", "1")))  # /l and /yl links uploading at once
+    ARIA2_RPC_PORT = int(getenv("ARIA2_RPC_PORT", "6800"))  # Local port of the aria2c daemon
+    ARIA2_MAX_DOWNLOADS = max(1, int(getenv("ARIA2_MAX_DOWNLOADS", "4")))  # Downloads aria2c runs at once, the rest wait
+    ARIA2_CONNECTIONS = max(1, int(getenv("ARIA2_CONNECTIONS", "32")))  # Connections shared by all aria2c downloads
+    ARIA2_FILE_ALLOCATION = getenv("ARIA2_FILE_ALLOCATION", "falloc")  # "falloc" reserves files up front, "none" for filesystems without fallocate
+    YTDLP_CONNECTIONS = max(1, int(getenv("YTDLP_CONNECTIONS", "8")))  # Fragments yt-dlp fetches at once for DASH/HLS
+    URL_DISK_MARGIN = int(float(getenv("URL_DISK_MARGIN_GB", "1")) * 1024**3)  # Free space /l downloads never use
+    URL_STREAM = getenv("URL_STREAM", "false").lower() == "true"  # Send big non-video /l files straight from HTTP, no disk
+    STREAM_CONNECTIONS = max(1, int(getenv("STREAM_CONNECTIONS", "4")))  # Range requests a streamed link runs at once
+    STREAM_BUFFER = max(8, int(getenv("STREAM_BUFFER_MB", "64"))) * 1024 * 1024  # Memory a streamed link may buffer
+    FILE_CACHE_PATH = getenv("FILE_CACHE_PATH", "file_cache.db")  # SQLite cache of uploaded file_ids
+    FILE_CACHE_MAX_ENTRIES = int(getenv("FILE_CACHE_MAX_ENTRIES", "50000"))  # Source files kept in the cache
+    FILE_CACHE_MAX_AGE_DAYS = float(getenv("FILE_CACHE_MAX_AGE_DAYS", "30"))  # Days before a cached file_id expires
@@ -0,0 +1,151 @@
+# bt/helpers/aria2.py
+# Long-lived aria2c daemon driven over JSON-RPC with aria2p
+
+import os
+import asyncio
+import secrets
+from typing import Optional, Tuple
+import aria2p
+from config import PyroConf
+from logger import LOGGER
+
+class Aria2Daemon:
+    """
+    One aria2c process shared by every download, started on first use
+    Downloads queue up in it and split one global connection budget
+    """
+
+    def __init__(self, port: int, max_downloads: int, connections: int):
+        self.port = port
+        self.max_downloads = max_downloads
+        # Connections each download may open, so all of them together stay within budget
+        self.split = max(1, connections // max_downloads)
+        self.secret = secrets.token_hex(16)
+        self.proc = None
+        self.api = None
+        self._lock = asyncio.Lock()
+
+    async def start(self) -> aria2p.API:
+        """Start the daemon unless it is already running, returns the RPC client"""
+        async with self._lock:
+            if self.proc and self.proc.returncode is None:
+                return self.api
+
+            cmd = [
+                "aria2c",
+                "--enable-rpc",
+                "--rpc-listen-all=false",
+                f"--rpc-listen-port={self.port}",
+                f"--rpc-secret={self.secret}",
+                f"--max-concurrent-downloads={self.max_downloads}",
+                f"--max-connection-per-server={min(self.split, 16)}",
+                f"--split={self.split}",
+                "--min-split-size=1M",
+                "--max-tries=5",
+                "--retry-wait=5",
+                "--timeout=60",
+                "--allow-overwrite=true",
+                "--auto-file-renaming=false",
+                # Reserve the whole file up front, a full disk fails at the start instead of midway
+                f"--file-allocation={PyroConf.ARIA2_FILE_ALLOCATION}",
+                "--console-log-level=warn",
+                "--summary-interval=0",
+                # Exits on its own when the bot goes away
+                f"--stop-with-process={os.getpid()}",
+            ]
+            LOGGER(__name__).info(f"Starting aria2c daemon on port {self.port}")
+            self.proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            self.api = aria2p.API(
+                aria2p.Client(host="http://localhost", port=self.port, secret=self.secret)
+            )
+
+            # Wait for the RPC interface to come up
+            for _ in range(50):
+                if self.proc.returncode is not None:
+                    raise RuntimeError(f"aria2c daemon exited with code {self.proc.returncode}")
+                try:
+                    await asyncio.to_thread(self.api.get_stats)
+                    return self.api
+                except Exception:
+                    await asyncio.sleep(0.2)
+
+            self.proc.kill()
+            await self.proc.wait()
+            raise RuntimeError("aria2c daemon did not answer on its RPC port")
+
+    @property
+    def running(self) -> bool:
+        return bool(self.proc and self.proc.returncode is None)
+
+    async def pause(self, gid: str) -> None:
+        """Pause a queued or active download, it keeps its place and partial data"""
+        api = await self.start()
+        await asyncio.to_thread(api.client.pause, gid)
+
+    async def resume(self, gid: str) -> None:
+        api = await self.start()
+        await asyncio.to_thread(api.client.unpause, gid)
+
+    async def stats(self) -> Optional[aria2p.Stats]:
+        """Global speed and queue counts, None while the daemon isn't running"""
+        if not self.running:
+            return None
+        return await asyncio.to_thread(self.api.get_stats)
+
+    async def download(
+        self, url: str, download_path: str, progress=None, progress_args=(), on_state=None
+    ) -> Tuple[bool, str]:
+        """
+        Queue a URL and wait for it, reporting byte progress like Pyrogram does
+        `on_state(gid, state)` is awaited whenever aria2 moves it between waiting, active and paused
+        Returns (success, path or error message); a cancelled download is removed from the daemon
+        """
+        api = await self.start()
+        options = {
+            "dir": os.path.abspath(os.path.dirname(download_path)),
+            "out": os.path.basename(download_path),
+        }
+        download = await asyncio.to_thread(api.add_uris, [url], options)
+        LOGGER(__name__).info(f"Queued aria2 download {download.gid}: {url}")
+        state = None
+
+        try:
+            while True:
+                await asyncio.sleep(1)
+                await asyncio.to_thread(download.update)
+
+                if on_state and download.status != state and download.status in ("waiting", "active", "paused"):
+                    state = download.status
+                    await on_state(download.gid, state)
+
+                # Callbacks like pyleaves divide by the bytes done so far
+                if progress and download.status == "active" and download.total_length and download.completed_length:
+                    try:
+                        await progress(download.completed_length, download.total_length, *progress_args)
+                    except Exception as e:
+                        LOGGER(__name__).warning(f"Progress update for {download.gid} failed: {e}")
+
+                if download.is_complete:
+                    return True, download_path
+                if download.status in ("error", "removed"):
+                    return False, download.error_message or f"Download {download.status}"
+        except BaseException:
+            await asyncio.to_thread(api.remove, [download], force=True, files=True, clean=True)
+            raise
+        finally:
+            # Keep the daemon's result list from growing
+            try:
+                await asyncio.to_thread(api.client.remove_download_result, download.gid)
+            except Exception:
+                pass
+
+# Global instance
+aria2_daemon = Aria2Daemon(
+    PyroConf.ARIA2_RPC_PORT,
+    PyroConf.ARIA2_MAX_DOWNLOADS,
+    PyroConf.ARIA2_CONNECTIONS,
+)
@@ -0,0 +1,128 @@
+# bt/helpers/cache.py
+# Persistent cache of bot-side file_ids for media that was already uploaded
+
+import sqlite3
+from time import time
+from typing import List, Optional, Tuple
+from config import PyroConf
+from logger import LOGGER
+
+class FileIdCache:
+    """
+    SQLite backed map of source file_unique_id + split part index to the
+    file_id the bot got back when it uploaded that part
+    """
+    def __init__(self, path: str, max_entries: int, max_age: float):
+        self.path = path
+        self.max_entries = max_entries  # Max number of cached source files
+        self.max_age = max_age  # Seconds before an entry is considered stale
+        self.hits = 0
+        self.misses = 0
+        self.conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_ids ("
+                "unique_id TEXT NOT NULL, "
+                "part INTEGER NOT NULL, "
+                "total INTEGER NOT NULL, "
+                "media_type TEXT NOT NULL, "
+                "file_id TEXT NOT NULL, "
+                "file_size INTEGER, "
+                "created REAL NOT NULL, "
+                "last_used REAL NOT NULL, "
+                "PRIMARY KEY (unique_id, part))"
+            )
+            self.conn.commit()
+        return self.conn
+
+    def get(self, unique_id: str) -> Optional[List[Tuple[str, str]]]:
+        """
+        Get cached parts of a source file
+        Returns list of (media_type, file_id) ordered by part, or None unless every part is cached
+        """
+        try:
+            conn = self._connect()
+            rows = conn.execute(
+                "SELECT part, total, media_type, file_id FROM file_ids "
+                "WHERE unique_id = ? AND created >= ? ORDER BY part",
+                (unique_id, time() - self.max_age),
+            ).fetchall()
+
+            if not rows or len(rows) != rows[0][1]:
+                self.misses += 1
+                return None
+
+            conn.execute(
+                "UPDATE file_ids SET last_used = ? WHERE unique_id = ?",
+                (time(), unique_id),
+            )
+            conn.commit()
+        except Exception as e:
+            LOGGER(__name__).error(f"File cache lookup failed: {e}")
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        LOGGER(__name__).info(f"File cache hit for {unique_id} ({len(rows)} part(s))")
+        return [(media_type, file_id) for _, _, media_type, file_id in rows]
+
+    def put(self, unique_id: str, parts: List[Tuple[str, str]], file_size: Optional[int] = None) -> None:
+        """Store all uploaded parts of a source file, replacing any older entry"""
+        if not parts:
+            return
+
+        now = time()
+        try:
+            conn = self._connect()
+            conn.execute("DELETE FROM file_ids WHERE unique_id = ?", (unique_id,))
+            conn.executemany(
+                "INSERT INTO file_ids VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (unique_id, part, len(parts), media_type, file_id, file_size, now, now)
+                    for part, (media_type, file_id) in enumerate(parts)
+                ],
+            )
+            conn.commit()
+            self.evict()
+        except Exception as e:
+            LOGGER(__name__).error(f"File cache store failed: {e}")
+
+    def invalidate(self, unique_id: str) -> None:
+        """Drop a source file whose cached file_ids stopped working"""
+        try:
+            conn = self._connect()
+            conn.execute("DELETE FROM file_ids WHERE unique_id = ?", (unique_id,))
+            conn.commit()
+        except Exception as e:
+            LOGGER(__name__).error(f"File cache invalidate failed: {e}")
+
+    def evict(self) -> None:
+        """Remove stale entries, then the least recently used ones above max_entries"""
+        conn = self._connect()
+        conn.execute("DELETE FROM file_ids WHERE created < ?", (time() - self.max_age,))
+        conn.execute(
+            "DELETE FROM file_ids WHERE unique_id NOT IN ("
+            "SELECT unique_id FROM file_ids GROUP BY unique_id "
+            "ORDER BY MAX(last_used) DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+        conn.commit()
+
+    def count(self) -> int:
+        """Number of cached source files"""
+        try:
+            return self._connect().execute(
+                "SELECT COUNT(DISTINCT unique_id) FROM file_ids"
+            ).fetchone()[0]
+        except Exception:
+            return 0
+
+# Global instance
+file_id_cache = FileIdCache(
+    PyroConf.FILE_CACHE_PATH,
+    PyroConf.FILE_CACHE_MAX_ENTRIES,
+    PyroConf.FILE_CACHE_MAX_AGE_DAYS * 86400,
+)
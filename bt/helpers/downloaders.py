@@ -4,10 +4,16 @@
 import os
 import asyncio
 import json
+import threading
+import urllib.request
+from email.message import Message
 from typing import List, Optional, Tuple
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadCancelled
 from logger import LOGGER
-from helpers.files import get_readable_file_size, get_download_path
+from helpers.files import get_readable_file_size, get_download_path, cleanup_download
 from helpers.utils import cmd_exec
+from helpers.aria2 import aria2_daemon
 from config import PyroConf
 
 async def save_cookies(cookies_text: str) -> bool:
@@ -54,173 +60,260 @@ async def save_cookies(cookies_text: str) -> bool:
         LOGGER(__name__).error(f"Error saving cookies: {e}")
         return False
 
-async def aria2c_download(url: str, download_path: str, progress_callback=None) -> Tuple[bool, str]:
+def _probe_response(response) -> dict:
+    headers = response.headers
+    size = None
+    accepts_ranges = headers.get("Accept-Ranges", "").lower() == "bytes"
+    
+    # A ranged reply carries the full size after the slash: "bytes 0-0/12345"
+    content_range = headers.get("Content-Range", "")
+    if response.status == 206 and "/" in content_range:
+        accepts_ranges = True
+        total = content_range.rsplit("/", 1)[1]
+        if total.isdigit():
+            size = int(total)
+    elif headers.get("Content-Length", "").isdigit():
+        size = int(headers["Content-Length"])
+    
+    file_name = None
+    if headers.get("Content-Disposition"):
+        # Message knows both filename= and the RFC 2231 filename*= forms
+        disposition = Message()
+        disposition["Content-Disposition"] = headers["Content-Disposition"]
+        file_name = disposition.get_filename()
+    
+    return {
+        "url": response.geturl(),
+        "size": size,
+        "file_name": os.path.basename(file_name) if file_name else None,
+        "accepts_ranges": accepts_ranges,
+    }
+
+def _http_probe(url: str) -> dict:
+    headers = {"User-Agent": "Mozilla/5.0"}
+    try:
+        request = urllib.request.Request(url, headers=headers, method="HEAD")
+        with urllib.request.urlopen(request, timeout=15) as response:
+            return _probe_response(response)
+    except Exception as e:
+        # Plenty of servers refuse HEAD, ask for the first byte instead
+        LOGGER(__name__).info(f"HEAD failed for {url} ({e}), trying a range request")
+    
+    request = urllib.request.Request(url, headers={**headers, "Range": "bytes=0-0"})
+    with urllib.request.urlopen(request, timeout=15) as response:
+        return _probe_response(response)
+
+async def probe_url(url: str) -> Optional[dict]:
     """
-    Download file using aria2c
+    Ask the server about a URL before downloading it
+    Returns {url, size, file_name, accepts_ranges}, size and file_name may be None,
+    or None if the server couldn't be probed at all
     """
     try:
-        cmd = [
-            "aria2c",
-            "--max-connection-per-server=16",
-            "--split=16",
-            "--min-split-size=1M",
-            "--max-tries=5",
-            "--retry-wait=5",
-            "--timeout=60",
-            "--dir", os.path.dirname(download_path),
-            "--out", os.path.basename(download_path),
-            "--console-log-level=error",
-            "--summary-interval=10",
-            "--allow-overwrite=true",
-            url
-        ]
-        
+        info = await asyncio.to_thread(_http_probe, url)
+        LOGGER(__name__).info(
+            f"Probed {url}: size={info['size']}, name={info['file_name']}, ranges={info['accepts_ranges']}"
+        )
+        return info
+    except Exception as e:
+        LOGGER(__name__).warning(f"Could not probe {url}: {e}")
+        return None
+
+async def aria2c_download(
+    url: str, download_path: str, progress=None, progress_args=(), on_state=None
+) -> Tuple[bool, str]:
+    """
+    Download file through the shared aria2c daemon
+    `progress(current, total, *progress_args)` gets byte progress like Pyrogram's callbacks
+    `on_state(gid, state)` hears when it is queued, started or paused in the daemon
+    Whatever a failed or cancelled download left behind is removed
+    """
+    completed = False
+    try:
         LOGGER(__name__).info(f"Starting aria2c download: {url}")
-        
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+        success, result = await aria2_daemon.download(
+            url, download_path, progress, progress_args, on_state
         )
         
-        # Monitor progress if callback provided
-        if progress_callback:
-            asyncio.create_task(_monitor_aria2c_progress(process, progress_callback))
-        
-        stdout, stderr = await process.communicate()
-        
-        if process.returncode == 0:
+        if success:
             LOGGER(__name__).info(f"Successfully downloaded: {download_path}")
-            return True, download_path
+            completed = True
         else:
-            error_msg = stderr.decode() if stderr else "Unknown error"
-            LOGGER(__name__).error(f"aria2c download failed: {error_msg}")
-            return False, error_msg
+            LOGGER(__name__).error(f"aria2c download failed: {result}")
+        return success, result
             
     except Exception as e:
         LOGGER(__name__).error(f"Error in aria2c download: {e}")
         return False, str(e)
+    finally:
+        if not completed:
+            cleanup_download(download_path)
+            cleanup_download(download_path + ".aria2")  # aria2c control file
 
-async def _monitor_aria2c_progress(process, callback):
-    """Monitor aria2c download progress"""
-    while process.returncode is None:
-        await callback()
-        await asyncio.sleep(2)
+def _cleanup_partial_files(download_path: str) -> None:
+    """Remove the partial output (.part, .ytdl, format files) of a yt-dlp download"""
+    directory = os.path.dirname(download_path)
+    base_without_ext = os.path.splitext(os.path.basename(download_path))[0]
+    if not os.path.isdir(directory):
+        return
+    for file in os.listdir(directory):
+        if file.startswith(base_without_ext):
+            cleanup_download(os.path.join(directory, file))
 
-async def ytdlp_download(url: str, download_path: str, use_aria2c: bool = True, progress_message=None) -> Tuple[bool, str, str]:
+class _YtdlpJob:
     """
-    Download video using yt-dlp with optional aria2c external downloader
-    Returns: (success, file_path, video_title)
+    One yt_dlp.YoutubeDL extraction and download run in a worker thread
+    Hooks fire in that thread; progress is handed to the event loop and
+    cancellation is handed back through a flag the hooks check
+    Selected formats are downloaded as they are, merging is left to the caller
+    so ffmpeg runs as an owned process that /killall can stop
     """
-    try:
-        # First, get video info including title
-        info_cmd = [
-            "yt-dlp",
-            "--print", "%(title)s",
-            "--no-warnings",
-            "--no-playlist",
-            url
-        ]
-        
-        # Get video title
-        process = await asyncio.create_subprocess_exec(
-            *info_cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        
-        stdout, stderr = await process.communicate()
-        video_title = stdout.decode().strip() if stdout else None
-        
-        if not video_title:
-            video_title = None
-            LOGGER(__name__).info("Could not get video title from yt-dlp")
-        else:
-            LOGGER(__name__).info(f"Video title: {video_title}")
-        
-        # Base yt-dlp command for download
-        cmd = [
-            "yt-dlp",
-            "-o", download_path,
-            "--no-warnings",
-            "--no-playlist",
-            "--prefer-free-formats",
-            "--remux-video", "mp4",
-        ]
+
+    def __init__(self, url: str, download_path: str, progress, progress_args):
+        self.url = url
+        self.download_path = download_path
+        self.progress = progress
+        self.progress_args = progress_args
+        self.loop = asyncio.get_running_loop()
+        self.cancelled = threading.Event()
+        self.done_bytes = 0  # Bytes of the formats already downloaded
+        self._pending = None  # Progress update not delivered yet
+
+    def _progress_hook(self, d: dict) -> None:
+        if self.cancelled.is_set():
+            raise DownloadCancelled("Download cancelled")
+        if d["status"] == "finished":
+            self.done_bytes += d.get("total_bytes") or d.get("downloaded_bytes") or 0
+            return
+        total = d.get("total_bytes") or d.get("total_bytes_estimate")
+        downloaded = d.get("downloaded_bytes") or 0
+        # pyleaves divides by the bytes done so far
+        if self.progress and total and downloaded and d["status"] == "downloading":
+            # Drop updates while the previous one is still being sent
+            if self._pending is None or self._pending.done():
+                self._pending = asyncio.run_coroutine_threadsafe(
+                    self._report(self.done_bytes + min(downloaded, total), self.done_bytes + total),
+                    self.loop,
+                )
+
+    async def _report(self, current: int, total: int) -> None:
+        try:
+            await self.progress(current, total, *self.progress_args)
+        except Exception as e:
+            LOGGER(__name__).warning(f"yt-dlp progress update failed: {e}")
+
+    def options(self) -> dict:
+        options = {
+            "noplaylist": True,
+            "quiet": True,
+            "no_warnings": True,
+            "noprogress": True,
+            "prefer_free_formats": True,
+            # yt-dlp's own downloader, so hooks see every block and can stop it
+            "concurrent_fragment_downloads": PyroConf.YTDLP_CONNECTIONS,
+            "http_chunk_size": 10 * 1024 * 1024,
+            "progress_hooks": [self._progress_hook],
+            "logger": LOGGER(__name__),
+        }
         
         # Add cookies if available
         if os.path.exists(PyroConf.COOKIES_FILE):
-            cmd.extend(["--cookies", PyroConf.COOKIES_FILE])
+            options["cookiefile"] = PyroConf.COOKIES_FILE
             LOGGER(__name__).info("Using cookies for yt-dlp")
-        
-        # Add aria2c as external downloader if requested
-        if use_aria2c:
-            cmd.extend([
-                "--external-downloader", "aria2c",
-                "--external-downloader-args", "aria2c:--max-connection-per-server=16 --split=16 --min-split-size=1M"
-            ])
-            LOGGER(__name__).info("Using aria2c as external downloader")
-        
-        # Add progress output
-        cmd.extend(["--newline", "--progress"])
-        
-        # Add URL
-        cmd.append(url)
-        
+        return options
+
+    def run(self) -> Tuple[List[str], Optional[str]]:
+        """Extract once and download the selected formats, returns (file_paths, title)"""
+        base = os.path.splitext(self.download_path)[0]
+        paths = []
+        with YoutubeDL(self.options()) as ydl:
+            info = ydl.extract_info(self.url, download=False)
+            # A video+audio selection lists both, a single format is merged into info
+            for fmt in info.get("requested_formats") or [info]:
+                if self.cancelled.is_set():
+                    raise DownloadCancelled("Download cancelled")
+                path = f"{base}.f{fmt.get('format_id')}.{fmt.get('ext') or 'mp4'}"
+                if not ydl.dl(path, {**info, **fmt}):
+                    raise RuntimeError(f"Downloading format {fmt.get('format_id')} failed")
+                paths.append(path)
+        return paths, info.get("title")
+
+async def _mux_to_mp4(paths: List[str], download_path: str) -> str:
+    """
+    Merge the downloaded formats, or remux a single one, into an MP4 next to them
+    Returns the file to send
+    """
+    base = os.path.splitext(download_path)[0]
+    if len(paths) == 1 and paths[0].endswith(".mp4"):
+        os.replace(paths[0], base + ".mp4")
+        return base + ".mp4"
+    
+    # MKV takes any codec pair MP4 refuses
+    for ext in (".mp4", ".mkv"):
+        output_path = base + ext
+        cmd = ["ffmpeg", "-y", "-v", "error"]
+        for path in paths:
+            cmd.extend(["-i", path])
+        for n in range(len(paths)):
+            cmd.extend(["-map", str(n)])
+        cmd.extend(["-c", "copy", output_path])
+        
+        _, stderr, returncode = await cmd_exec(cmd, slot="io")
+        if returncode == 0:
+            for path in paths:
+                cleanup_download(path)
+            return output_path
+        cleanup_download(output_path)
+        LOGGER(__name__).warning(f"Muxing into {ext} failed: {stderr}")
+        
+        if len(paths) == 1:
+            # Like yt-dlp's remuxer, keep the original when it can't be remuxed
+            return paths[0]
+    
+    raise RuntimeError("Could not merge the downloaded formats")
+
+async def ytdlp_download(
+    url: str, download_path: str, progress=None, progress_args=()
+) -> Tuple[bool, str, str]:
+    """
+    Download video with the yt_dlp Python API in a worker thread
+    `progress(current, total, *progress_args)` gets byte progress like Pyrogram's callbacks
+    Returns: (success, file_path or error message, video_title)
+    Whatever a failed or cancelled download left behind is removed
+    """
+    completed = False
+    job = _YtdlpJob(url, download_path, progress, progress_args)
+    worker = asyncio.ensure_future(asyncio.to_thread(job.run))
+    
+    def worker_done(future):
+        if not future.cancelled():
+            future.exception()  # Retrieved, even if nobody waits for it anymore
+        if job.cancelled.is_set():
+            # Files the thread wrote after we stopped waiting for it
+            _cleanup_partial_files(download_path)
+    
+    worker.add_done_callback(worker_done)
+    try:
         LOGGER(__name__).info(f"Starting yt-dlp download: {url}")
-        
-        if progress_message:
-            await progress_message.edit("**📥 Downloading with yt-dlp...**")
-        
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        
-        # Read output in real-time for progress
-        while True:
-            line = await process.stdout.readline()
-            if not line:
-                break
-            
-            line = line.decode().strip()
-            if '[download]' in line and '%' in line and progress_message:
-                # Extract percentage from yt-dlp output
-                try:
-                    percent_str = line.split('%')[0].split()[-1]
-                    await progress_message.edit(f"**📥 Downloading: {percent_str}%**")
-                except:
-                    pass
-        
-        await process.wait()
-        
-        if process.returncode == 0:
-            # yt-dlp might change the filename, find the actual file
-            actual_file = _find_downloaded_file(os.path.dirname(download_path), os.path.basename(download_path))
-            if actual_file:
-                LOGGER(__name__).info(f"Successfully downloaded: {actual_file}")
-                # Return 3 values: success, file_path, video_title
-                return True, actual_file, video_title
-            else:
-                return False, "Downloaded file not found", None
-        else:
-            stderr_data = await process.stderr.read()
-            error_msg = stderr_data.decode() if stderr_data else "Unknown error"
-            LOGGER(__name__).error(f"yt-dlp download failed: {error_msg}")
-            return False, error_msg, None
+        try:
+            paths, video_title = await asyncio.shield(worker)
+        except asyncio.CancelledError:
+            # The thread can't be interrupted, its next hook call stops it
+            # and it cleans up after itself, don't hold the cancelled task for it
+            job.cancelled.set()
+            raise
+        
+        file_path = await _mux_to_mp4(paths, download_path)
+        LOGGER(__name__).info(f"Successfully downloaded: {file_path} ({video_title})")
+        completed = True
+        return True, file_path, video_title
             
     except Exception as e:
-        LOGGER(__name__).error(f"Error in yt-dlp download: {e}")
+        LOGGER(__name__).error(f"yt-dlp download failed: {e}")
         return False, str(e), None
-
-def _find_downloaded_file(directory: str, base_name: str) -> Optional[str]:
-    """Find the actual downloaded file (yt-dlp might change extension)"""
-    base_without_ext = os.path.splitext(base_name)[0]
-    for file in os.listdir(directory):
-        if file.startswith(base_without_ext):
-            return os.path.join(directory, file)
-    return None
+    finally:
+        if not completed:
+            _cleanup_partial_files(download_path)
 
 def is_video_file(file_path: str) -> bool:
     """Check if file is a video based on extension and mime type"""
@@ -234,83 +327,3 @@ def is_video_file(file_path: str) -> bool:
     from mimetypes import guess_type
     mime_type, _ = guess_type(file_path)
     return mime_type and mime_type.startswith('video')
-
-async def split_file_p7zip(file_path: str, max_size_mb: int = 2000, progress_message=None) -> List[str]:
-    """
-    Split file using p7zip into parts smaller than max_size_mb
-    """
-    try:
-        if progress_message:
-            await progress_message.edit("**✂️ Splitting file with 7zip...**")
-        
-        file_size = os.path.getsize(file_path)
-        if file_size <= max_size_mb * 1024 * 1024:
-            return []  # No need to split
-        
-        base_name = os.path.splitext(os.path.basename(file_path))[0]
-        output_dir = os.path.dirname(file_path)
-        output_base = os.path.join(output_dir, f"{base_name}_part")
-        
-        # Use 7z to split the file
-        cmd = [
-            "7z", "a",
-            "-v" + str(max_size_mb) + "m",  # Volume size
-            "-mx=0",  # No compression (store mode)
-            f"{output_base}.7z",
-            file_path
-        ]
-        
-        LOGGER(__name__).info(f"Splitting file with 7zip: {file_path}")
-        
-        stdout, stderr, returncode = await cmd_exec(cmd)
-        
-        if returncode != 0:
-            LOGGER(__name__).error(f"7zip split failed: {stderr}")
-            return []
-        
-        # Find all created parts
-        part_files = []
-        part_num = 1
-        while True:
-            part_file = f"{output_base}.7z.{str(part_num).zfill(3)}"
-            if os.path.exists(part_file):
-                part_files.append(part_file)
-                part_num += 1
-            else:
-                # Check for the main file without number (first part)
-                if part_num == 1 and os.path.exists(f"{output_base}.7z"):
-                    part_files.append(f"{output_base}.7z")
-                break
-        
-        LOGGER(__name__).info(f"Created {len(part_files)} parts")
-        return part_files
-        
-    except Exception as e:
-        LOGGER(__name__).error(f"Error splitting file with p7zip: {e}")
-        return []
-
-async def extract_7z_parts(first_part_path: str, output_dir: str) -> Optional[str]:
-    """
-    Extract 7z split archives
-    """
-    try:
-        cmd = [
-            "7z", "x",
-            "-y",  # Yes to all prompts
-            f"-o{output_dir}",
-            first_part_path
-        ]
-        
-        stdout, stderr, returncode = await cmd_exec(cmd)
-        
-        if returncode == 0:
-            # Find extracted file
-            for file in os.listdir(output_dir):
-                file_path = os.path.join(output_dir, file)
-                if os.path.isfile(file_path):
-                    return file_path
-        return None
-        
-    except Exception as e:
-        LOGGER(__name__).error(f"Error extracting 7z parts: {e}")
-        return None
\ No newline at end of file
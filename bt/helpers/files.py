@@ -1,8 +1,11 @@
 # Copyright (C) @TheSmartBisnu
 # Channel: https://t.me/itsSmartDev
 
+import io
 import os
-from typing import Optional
+import shutil
+import asyncio
+from typing import Dict, Optional
 
 from logger import LOGGER
 
@@ -31,6 +34,125 @@ def cleanup_download(path: str) -> None:
         LOGGER(__name__).error(f"Cleanup failed for {path}: {e}")
 
 
+class DiskBudget:
+    """Byte budget bounding how much staged data may sit in downloads/ at once"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, size: int) -> int:
+        """Wait until `size` bytes fit, returns the amount actually reserved"""
+        # A file bigger than the whole budget still gets through, alone
+        size = min(max(size, 0), self.limit)
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.used + size <= self.limit)
+            self.used += size
+        return size
+
+    async def release(self, size: int) -> None:
+        async with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+class DiskSpace:
+    """
+    Free disk space promised to downloads whose size is known before they start
+    A reservation only counts the part of its file that isn't allocated on disk yet
+    """
+
+    def __init__(self, path: str = ".", margin: int = 0):
+        self.path = path
+        self.margin = margin  # Bytes always left free
+        self.reservations: Dict[str, int] = {}
+        self._condition = asyncio.Condition()
+
+    def _outstanding(self) -> int:
+        outstanding = 0
+        for file_path, size in self.reservations.items():
+            try:
+                allocated = os.stat(file_path).st_blocks * 512
+            except OSError:
+                allocated = 0
+            outstanding += max(size - allocated, 0)
+        return outstanding
+
+    def available(self) -> int:
+        return shutil.disk_usage(self.path).free - self.margin - self._outstanding()
+
+    async def reserve(self, file_path: str, size: int) -> bool:
+        """
+        Wait until `size` bytes fit next to the other reservations
+        Returns False right away if they can't fit even once everything else is done
+        """
+        async with self._condition:
+            while size > self.available():
+                # Released files are deleted, so at best their whole size comes back
+                if size > shutil.disk_usage(self.path).free - self.margin + sum(self.reservations.values()):
+                    return False
+                try:
+                    # Also re-check now and then, space may be freed elsewhere
+                    await asyncio.wait_for(self._condition.wait(), 10)
+                except asyncio.TimeoutError:
+                    pass
+            self.reservations[file_path] = self.reservations.get(file_path, 0) + size
+            return True
+
+    async def release(self, file_path: str) -> None:
+        async with self._condition:
+            self.reservations.pop(file_path, None)
+            self._condition.notify_all()
+
+
+class FileRange(io.RawIOBase):
+    """
+    Read-only view of `length` bytes of `path` starting at `offset`
+    Lets one volume of a big file be uploaded without writing it out first
+    """
+
+    def __init__(self, path: str, offset: int, length: int, name: str):
+        super().__init__()
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.name = name
+        self._pos = 0
+        self._fd = os.open(path, os.O_RDONLY)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, pos: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self.length
+        self._pos = min(max(pos, 0), self.length)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        size = min(len(buffer), self.length - self._pos)
+        if size <= 0:
+            return 0
+        data = os.pread(self._fd, size, self.offset + self._pos)
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            os.close(self._fd)
+        super().close()
+
+
 def get_readable_file_size(size_in_bytes: Optional[float]) -> str:
     if size_in_bytes is None or size_in_bytes < 0:
         return "0B"
@@ -0,0 +1,68 @@
+# bt/helpers/processes.py
+# Child processes owned by the task that started them
+
+import asyncio
+from typing import Dict, Set
+from contextlib import asynccontextmanager
+from asyncio.subprocess import Process
+from logger import LOGGER
+
+# Seconds a child gets to exit after SIGTERM before it is killed
+TERMINATE_GRACE = 5
+
+# Running children by owning task
+_owned_processes: Dict[asyncio.Task, Set[Process]] = {}
+
+async def spawn_process(*cmd, shell: bool = False, **kwargs) -> Process:
+    """Start a child process and register it to the current task"""
+    if shell:
+        proc = await asyncio.create_subprocess_shell(cmd[0], **kwargs)
+    else:
+        proc = await asyncio.create_subprocess_exec(*cmd, **kwargs)
+    _owned_processes.setdefault(asyncio.current_task(), set()).add(proc)
+    return proc
+
+async def terminate_process(proc: Process, grace: float = TERMINATE_GRACE) -> None:
+    """Stop a child with SIGTERM, SIGKILL it after `grace` seconds, and reap it"""
+    try:
+        if proc.returncode is None:
+            try:
+                proc.terminate()
+                await asyncio.wait_for(proc.wait(), grace)
+            except ProcessLookupError:
+                pass
+            except asyncio.TimeoutError:
+                LOGGER(__name__).warning(f"Process {proc.pid} ignored SIGTERM, killing it")
+                proc.kill()
+                await proc.wait()
+            except asyncio.CancelledError:
+                proc.kill()
+                raise
+    finally:
+        for task, procs in list(_owned_processes.items()):
+            procs.discard(proc)
+            if not procs:
+                del _owned_processes[task]
+
+@asynccontextmanager
+async def owned_process(*cmd, shell: bool = False, grace: float = TERMINATE_GRACE, **kwargs):
+    """
+    Run a child process for the duration of the block
+    Leaving the block for any reason (error, cancellation, timeout) terminates and reaps it
+    """
+    proc = await spawn_process(*cmd, shell=shell, **kwargs)
+    try:
+        yield proc
+    finally:
+        await terminate_process(proc, grace)
+
+async def terminate_all_processes() -> int:
+    """Terminate every registered child still running, returns how many there were"""
+    procs = {
+        proc
+        for procs in _owned_processes.values()
+        for proc in procs
+        if proc.returncode is None
+    }
+    await asyncio.gather(*(terminate_process(proc) for proc in procs), return_exceptions=True)
+    return len(procs)
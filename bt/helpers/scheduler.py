@@ -0,0 +1,128 @@
+# bt/helpers/scheduler.py
+# Shared slots for the ffmpeg/ffprobe processes every task spawns
+
+import os
+import heapq
+import asyncio
+from time import time
+from itertools import count
+from contextlib import asynccontextmanager
+from config import PyroConf
+from logger import LOGGER
+
+# Lower runs first: thumbnails and probes are short and block an upload,
+# splits and archives are long passes nobody is waiting on second by second
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+class _SlotPool:
+    """Fixed number of slots handed out by priority, then in arrival order"""
+
+    def __init__(self, name: str, slots: int):
+        self.name = name
+        self.slots = slots
+        self.running = 0
+        self._waiters = []  # Heap of (priority, seq, future)
+        self._seq = count()
+        # Queue-time metrics
+        self.started = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _wake_next(self) -> None:
+        while self._waiters and self.running < self.slots:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.running += 1
+                future.set_result(None)
+
+    async def acquire(self, priority: int) -> float:
+        """Wait for a slot, returns the seconds spent queued"""
+        start = time()
+        if self.running < self.slots and not self._waiters:
+            self.running += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._seq), future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Got the slot just as we were cancelled, pass it on
+                    self.release()
+                raise
+
+        waited = time() - start
+        self.started += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def release(self) -> None:
+        self.running -= 1
+        self._wake_next()
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+class SubprocessScheduler:
+    """
+    Bounds how many media subprocesses run at once across all tasks
+    "cpu" slots are for decoding work and short probes (thumbnails, ffprobe),
+    "io" slots for full sequential passes over big files (stream-copy splits,
+    packet scans)
+    """
+
+    def __init__(self, cpu_slots: int, io_slots: int):
+        self.pools = {
+            "cpu": _SlotPool("cpu", cpu_slots),
+            "io": _SlotPool("io", io_slots),
+        }
+
+    @property
+    def threads_per_job(self) -> int:
+        """Threads a CPU job may use without oversubscribing the machine"""
+        return max(1, (os.cpu_count() or 1) // self.pools["cpu"].slots)
+
+    async def acquire(self, kind: str, priority: int = PRIORITY_NORMAL, label: str = ""):
+        """
+        Wait for a slot of `kind`
+        Returns a release function, safe to call more than once
+        """
+        pool = self.pools[kind]
+        waited = await pool.acquire(priority)
+        if waited >= 1:
+            LOGGER(__name__).info(f"{label or kind} job waited {waited:.1f}s for a {kind} slot")
+
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                pool.release()
+
+        return release
+
+    @asynccontextmanager
+    async def slot(self, kind: str, priority: int = PRIORITY_NORMAL, label: str = ""):
+        release = await self.acquire(kind, priority, label)
+        try:
+            yield
+        finally:
+            release()
+
+    def stats(self) -> str:
+        lines = []
+        for pool in self.pools.values():
+            avg_wait = pool.total_wait / pool.started if pool.started else 0
+            lines.append(
+                f"{pool.name}: {pool.running}/{pool.slots} running, {pool.queued} queued, "
+                f"avg wait {avg_wait:.1f}s, max {pool.max_wait:.1f}s"
+            )
+        return "\n".join(lines)
+
+# Global instance
+media_scheduler = SubprocessScheduler(PyroConf.MEDIA_CPU_SLOTS, PyroConf.MEDIA_IO_SLOTS)
@@ -0,0 +1,168 @@
+# bt/helpers/streaming.py
+# HTTP downloads fed to the uploader through a bounded in-memory buffer
+
+import time
+import asyncio
+from typing import Dict, Set
+from urllib.parse import urlsplit, urlunsplit
+from http.client import HTTPConnection, HTTPSConnection
+from logger import LOGGER
+
+# Attempts per range request before the whole stream fails
+RANGE_RETRIES = 3
+
+class _RangeConnection:
+    """One keep-alive HTTP connection doing blocking range GETs, used from a worker thread"""
+
+    def __init__(self, url: str):
+        parsed = urlsplit(url)
+        self.connection_class = HTTPSConnection if parsed.scheme == "https" else HTTPConnection
+        self.host = parsed.netloc
+        self.path = urlunsplit(("", "", parsed.path or "/", parsed.query, ""))
+        self.connection = None
+
+    def get(self, start: int, end: int) -> bytes:
+        """Fetch bytes start..end (inclusive), retrying on a fresh connection"""
+        for attempt in range(1, RANGE_RETRIES + 1):
+            try:
+                if self.connection is None:
+                    self.connection = self.connection_class(self.host, timeout=60)
+                self.connection.request(
+                    "GET",
+                    self.path,
+                    headers={"Range": f"bytes={start}-{end}", "User-Agent": "Mozilla/5.0"},
+                )
+                response = self.connection.getresponse()
+                # Anything but 206 would be the whole file, don't read it into memory
+                if response.status != 206:
+                    raise RuntimeError(f"Server answered {response.status} to a range request")
+                data = response.read()
+                if len(data) != end - start + 1:
+                    raise RuntimeError(f"Got {len(data)} of {end - start + 1} bytes at offset {start}")
+                return data
+            except Exception as e:
+                self.close()
+                if attempt == RANGE_RETRIES:
+                    raise
+                LOGGER(__name__).warning(f"Range {start}-{end} failed ({e}), retrying")
+                time.sleep(2 * attempt)
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+class HttpRangeStream:
+    """
+    A URL fetched ahead in chunks over several range requests at once
+    At most `buffer_size` bytes are held; a chunk is dropped once every byte of
+    it has been read, which lets the fetchers move on to the next ones
+    Each byte must be read exactly once, in roughly increasing order
+    """
+
+    def __init__(
+        self,
+        url: str,
+        size: int,
+        connections: int = 4,
+        buffer_size: int = 64 * 1024 * 1024,
+        chunk_size: int = 4 * 1024 * 1024,
+    ):
+        self.url = url
+        self.size = size
+        self.connections = connections
+        self.chunk_size = chunk_size
+        self.chunk_count = (size + chunk_size - 1) // chunk_size
+        # Chunks ahead of the oldest unread one that may be fetched
+        self.window = max(connections + 1, buffer_size // chunk_size)
+        self._chunks: Dict[int, bytes] = {}
+        self._unread: Dict[int, int] = {}  # Bytes of a buffered chunk still to be read
+        self._dropped: Set[int] = set()
+        self._base = 0  # Oldest chunk not dropped yet
+        self._next = 0  # Next chunk to fetch
+        self._error = None
+        self._changed = asyncio.Condition()
+        self._workers = []
+
+    async def __aenter__(self):
+        self._workers = [asyncio.create_task(self._fetch()) for _ in range(self.connections)]
+        return self
+
+    async def __aexit__(self, *exc):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._chunks.clear()
+
+    async def _fetch(self) -> None:
+        connection = _RangeConnection(self.url)
+        try:
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(
+                        lambda: self._error
+                        or self._next >= self.chunk_count
+                        or self._next < self._base + self.window
+                    )
+                    if self._error or self._next >= self.chunk_count:
+                        return
+                    index = self._next
+                    self._next += 1
+
+                start = index * self.chunk_size
+                end = min(start + self.chunk_size, self.size) - 1
+                data = await asyncio.to_thread(connection.get, start, end)
+
+                async with self._changed:
+                    self._chunks[index] = data
+                    self._unread[index] = len(data)
+                    self._changed.notify_all()
+        except Exception as e:
+            LOGGER(__name__).error(f"Streaming {self.url} failed: {e}")
+            async with self._changed:
+                self._error = self._error or e
+                self._changed.notify_all()
+        finally:
+            await asyncio.to_thread(connection.close)
+
+    async def read(self, offset: int, size: int) -> bytes:
+        """Wait for and return `size` bytes at `offset`"""
+        pieces = []
+        while size > 0:
+            index, start = divmod(offset, self.chunk_size)
+            async with self._changed:
+                if index < self._base or index in self._dropped:
+                    raise RuntimeError(f"Bytes at offset {offset} were already read")
+                await self._changed.wait_for(lambda: index in self._chunks or self._error)
+                if index not in self._chunks:
+                    raise self._error
+
+                piece = self._chunks[index][start:start + size]
+                self._unread[index] -= len(piece)
+                if not self._unread[index]:
+                    del self._chunks[index], self._unread[index]
+                    self._dropped.add(index)
+                    while self._base in self._dropped:
+                        self._dropped.discard(self._base)
+                        self._base += 1
+                    self._changed.notify_all()
+
+            pieces.append(piece)
+            offset += len(piece)
+            size -= len(piece)
+        return b"".join(pieces)
+
+class StreamRange:
+    """
+    `length` bytes of an HttpRangeStream starting at `offset`, named like a file
+    The streaming counterpart of FileRange, for uploading one part of a stream
+    """
+
+    def __init__(self, stream: HttpRangeStream, offset: int, length: int, name: str):
+        self.stream = stream
+        self.offset = offset
+        self.length = length
+        self.name = name
+
+    async def read(self, offset: int, size: int) -> bytes:
+        return await self.stream.read(self.offset + offset, size)
@@ -0,0 +1,287 @@
+# bt/helpers/transfer.py
+# Parallel multi-connection Telegram transfers for large files
+
+import os
+import asyncio
+from typing import Dict
+from contextlib import nullcontext
+from pyrogram import raw
+from pyrogram.session import Session, Auth
+from pyrogram.file_id import FileId, FileType
+from helpers.files import FileRange
+from helpers.streaming import StreamRange
+from logger import LOGGER
+
+# upload.GetFile serves at most 1 MiB per request, offsets must be multiples of it
+DOWNLOAD_PART_SIZE = 1024 * 1024
+
+# upload.SaveBigFilePart accepts at most 512 KiB per part
+UPLOAD_PART_SIZE = 512 * 1024
+
+# Files smaller than this aren't worth opening extra connections for
+PARALLEL_MIN_SIZE = 20 * 1024 * 1024
+
+# Auth keys already authorized on foreign DCs, shared by every connection to that DC
+_dc_auth_keys: Dict[tuple, bytes] = {}
+_dc_auth_lock = asyncio.Lock()
+
+async def _get_dc_auth_key(client, dc_id: int) -> bytes:
+    """Return an auth key usable on `dc_id`, exporting the authorization once per DC"""
+    if dc_id == await client.storage.dc_id():
+        return await client.storage.auth_key()
+
+    key = (id(client), dc_id)
+    async with _dc_auth_lock:
+        if key not in _dc_auth_keys:
+            test_mode = await client.storage.test_mode()
+            auth_key = await Auth(client, dc_id, test_mode).create()
+
+            session = Session(client, dc_id, auth_key, test_mode, is_media=True)
+            await session.start()
+            try:
+                exported_auth = await client.invoke(
+                    raw.functions.auth.ExportAuthorization(dc_id=dc_id)
+                )
+                await session.invoke(
+                    raw.functions.auth.ImportAuthorization(
+                        id=exported_auth.id, bytes=exported_auth.bytes
+                    )
+                )
+            finally:
+                await session.stop()
+
+            _dc_auth_keys[key] = auth_key
+        return _dc_auth_keys[key]
+
+async def open_media_sessions(client, dc_id: int, count: int) -> list:
+    """Open `count` independent media connections to `dc_id`"""
+    auth_key = await _get_dc_auth_key(client, dc_id)
+    test_mode = await client.storage.test_mode()
+
+    sessions = [
+        Session(client, dc_id, auth_key, test_mode, is_media=True)
+        for _ in range(count)
+    ]
+    try:
+        await asyncio.gather(*(session.start() for session in sessions))
+    except Exception:
+        await close_media_sessions(sessions)
+        raise
+    return sessions
+
+async def close_media_sessions(sessions: list) -> None:
+    await asyncio.gather(*(session.stop() for session in sessions), return_exceptions=True)
+
+class _FileCalls:
+    """
+    Blocking file calls run in threads, tracked so the fd they use can outlive them
+    Cancelling the awaiting task doesn't stop a call that is already running
+    """
+
+    def __init__(self):
+        self._pending = set()
+
+    async def run(self, func, *args):
+        future = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+        return await asyncio.shield(future)
+
+    async def wait(self) -> None:
+        """Wait for every call still running, call before closing their fd"""
+        while self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+def _get_file_location(file_id: FileId):
+    if file_id.file_type == FileType.PHOTO:
+        return raw.types.InputPhotoFileLocation(
+            id=file_id.media_id,
+            access_hash=file_id.access_hash,
+            file_reference=file_id.file_reference,
+            thumb_size=file_id.thumbnail_size,
+        )
+    return raw.types.InputDocumentFileLocation(
+        id=file_id.media_id,
+        access_hash=file_id.access_hash,
+        file_reference=file_id.file_reference,
+        thumb_size=file_id.thumbnail_size or "",
+    )
+
+async def parallel_download(
+    client, media, file_name: str, connections: int = 4, progress=None, progress_args=()
+) -> str:
+    """
+    Download a Telegram media object over several connections to its DC
+    Parts are written at their own offsets, so they can land in any order
+    Returns the path of the downloaded file
+    """
+    file_id = FileId.decode(media.file_id)
+    location = _get_file_location(file_id)
+    file_size = media.file_size
+    part_count = (file_size + DOWNLOAD_PART_SIZE - 1) // DOWNLOAD_PART_SIZE
+    connections = max(1, min(connections, part_count))
+
+    os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+    temp_path = file_name + ".temp"
+
+    LOGGER(__name__).info(
+        f"Parallel download of {part_count} parts over {connections} connections to DC {file_id.dc_id}"
+    )
+
+    sessions = await open_media_sessions(client, file_id.dc_id, connections)
+    file_calls = _FileCalls()
+    next_part = 0
+    downloaded = 0
+
+    async def fetch_parts(session, fd):
+        nonlocal next_part, downloaded
+
+        while next_part < part_count:
+            part = next_part
+            next_part += 1
+
+            r = await session.invoke(
+                raw.functions.upload.GetFile(
+                    location=location,
+                    offset=part * DOWNLOAD_PART_SIZE,
+                    limit=DOWNLOAD_PART_SIZE,
+                ),
+                sleep_threshold=30,
+            )
+            if not isinstance(r, raw.types.upload.File):
+                raise RuntimeError("File is served from a CDN, parallel download not supported")
+
+            await file_calls.run(os.pwrite, fd, r.bytes, part * DOWNLOAD_PART_SIZE)
+
+            downloaded += len(r.bytes)
+            if progress:
+                await progress(min(downloaded, file_size), file_size, *progress_args)
+
+    try:
+        with open(temp_path, "wb") as f:
+            f.truncate(file_size)
+            workers = [asyncio.create_task(fetch_parts(session, f.fileno())) for session in sessions]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                # Stop the other connections on error and let pending writes settle
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                # The fd closes below, no write may still be using it
+                await file_calls.wait()
+        os.replace(temp_path, file_name)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        await close_media_sessions(sessions)
+
+    return file_name
+
+async def parallel_save_file(
+    client, path, connections: int = 4, progress=None, progress_args=()
+):
+    """
+    Upload a local file (or a FileRange of one, or a StreamRange) with upload.SaveBigFilePart
+    over several connections
+    Returns the InputFileBig to post the media with, like Client.save_file
+    """
+    if isinstance(path, StreamRange):
+        source, base_offset, file_size, name = None, 0, path.length, path.name
+    elif isinstance(path, FileRange):
+        source, base_offset, file_size, name = path.path, path.offset, path.length, path.name
+    else:
+        source, base_offset, file_size, name = path, 0, os.path.getsize(path), os.path.basename(path)
+    part_count = (file_size + UPLOAD_PART_SIZE - 1) // UPLOAD_PART_SIZE
+    connections = max(1, min(connections, part_count))
+    file_id = int.from_bytes(os.urandom(8), "little", signed=True)
+
+    LOGGER(__name__).info(f"Parallel upload of {part_count} parts over {connections} connections")
+
+    sessions = await open_media_sessions(client, await client.storage.dc_id(), connections)
+    file_calls = _FileCalls()
+    next_part = 0
+    uploaded = 0
+
+    async def send_parts(session, fd):
+        nonlocal next_part, uploaded
+
+        while next_part < part_count:
+            part = next_part
+            next_part += 1
+
+            offset = part * UPLOAD_PART_SIZE
+            size = min(UPLOAD_PART_SIZE, file_size - offset)
+            if fd is None:
+                chunk = await path.read(offset, size)
+            else:
+                chunk = await file_calls.run(os.pread, fd, size, base_offset + offset)
+            await session.invoke(
+                raw.functions.upload.SaveBigFilePart(
+                    file_id=file_id,
+                    file_part=part,
+                    file_total_parts=part_count,
+                    bytes=chunk,
+                ),
+                sleep_threshold=30,
+            )
+
+            uploaded += len(chunk)
+            if progress:
+                await progress(min(uploaded, file_size), file_size, *progress_args)
+
+    try:
+        with open(source, "rb") if source else nullcontext() as f:
+            fd = f.fileno() if f else None
+            workers = [asyncio.create_task(send_parts(session, fd)) for session in sessions]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                await file_calls.wait()
+    finally:
+        await close_media_sessions(sessions)
+
+    return raw.types.InputFileBig(
+        id=file_id, parts=part_count, name=name
+    )
+
+def enable_parallel_upload(client, connections: int = 4) -> None:
+    """
+    Route large uploads of `client` through parallel_save_file
+    Every send method (reply_video, send_media_group, ...) goes through save_file,
+    small files and failures keep using the default single-connection path
+    """
+    default_save_file = client.save_file
+
+    async def save_file(path, file_id=None, file_part=0, progress=None, progress_args=()):
+        if isinstance(path, FileRange):
+            size = path.length
+        elif isinstance(path, str):
+            size = os.path.getsize(path)
+        else:
+            size = 0
+
+        if file_id is None and file_part == 0 and size >= PARALLEL_MIN_SIZE:
+            try:
+                return await parallel_save_file(
+                    client, path, connections, progress=progress, progress_args=progress_args
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LOGGER(__name__).warning(f"Parallel upload failed, using default engine: {e}")
+
+        return await default_save_file(
+            path,
+            file_id=file_id,
+            file_part=file_part,
+            progress=progress,
+            progress_args=progress_args,
+        )
+
+    client.save_file = save_file
@@ -2,17 +2,24 @@
 # Updated version with video splitting functionality
 
 import os
+import json
+import signal
 import uuid
 import asyncio
 from time import time
-from PIL import Image
 from logger import LOGGER
-from typing import Optional, List
+from typing import Optional, List, Tuple, AsyncIterator
+from collections import OrderedDict
+from contextlib import aclosing
 from asyncio.subprocess import PIPE
-from asyncio import create_subprocess_exec, create_subprocess_shell, wait_for
+from asyncio import wait_for
 from pyleaves import Leaves
+from mimetypes import guess_type
+from pyrogram import raw
 from pyrogram.parser import Parser
+from pyrogram.file_id import FileId, FileType
 from pyrogram.utils import get_channel_id
+from pyrogram.errors import BadRequest, Forbidden
 from pyrogram.types import (
     InputMediaPhoto,
     InputMediaVideo,
@@ -28,6 +35,15 @@ from helpers.files import (
 from helpers.msg import (
     get_parsed_msg
 )
+from helpers.cache import file_id_cache
+from helpers.transfer import parallel_download, parallel_save_file, PARALLEL_MIN_SIZE
+from helpers.streaming import StreamRange
+from helpers.scheduler import media_scheduler, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from helpers.processes import owned_process, spawn_process, terminate_process
+from config import PyroConf
+
+# Largest file a bot can upload (2000 MiB)
+TELEGRAM_UPLOAD_LIMIT = 2000 * 1024 * 1024
 
 # Progress bar template
 PROGRESS_BAR = """
@@ -36,12 +52,21 @@ Speed: {speed}/s
 Estimated Time Left: {est_time} seconds
 """
 
-async def cmd_exec(cmd, shell=False):
-    if shell:
-        proc = await create_subprocess_shell(cmd, stdout=PIPE, stderr=PIPE)
-    else:
-        proc = await create_subprocess_exec(*cmd, stdout=PIPE, stderr=PIPE)
-    stdout, stderr = await proc.communicate()
+async def cmd_exec(cmd, shell=False, slot=None, priority=PRIORITY_NORMAL, timeout=None):
+    """
+    Run a command and collect its output
+    With `slot` ("cpu" or "io") the command waits for a media_scheduler slot first
+    `timeout` only counts once it runs, time spent waiting for the slot is not included
+    The child is terminated if the calling task is cancelled or times out
+    """
+    if slot:
+        label = cmd.split()[0] if shell else cmd[0]
+        async with media_scheduler.slot(slot, priority, label):
+            return await cmd_exec(cmd, shell, timeout=timeout)
+    
+    args = [cmd] if shell else cmd
+    async with owned_process(*args, shell=shell, stdout=PIPE, stderr=PIPE) as proc:
+        stdout, stderr = await wait_for(proc.communicate(), timeout)
     try:
         stdout = stdout.decode().strip()
     except:
@@ -52,111 +77,455 @@ async def cmd_exec(cmd, shell=False):
         stderr = "Unable to decode the error!"
     return stdout, stderr, proc.returncode
 
-async def get_media_info(path):
+# Probe results keyed by (path, size, mtime), most recently used last
+MEDIA_PROBE_CACHE_SIZE = 256
+_media_probes: "OrderedDict[tuple, asyncio.Task]" = OrderedDict()
+
+def _parse_probe(output: str) -> dict:
+    data = json.loads(output)
+    fields = data.get("format") or {}
+    streams = data.get("streams") or []
+    video = next((st for st in streams if st.get("codec_type") == "video"), {})
+    audio = next((st for st in streams if st.get("codec_type") == "audio"), {})
+    tags = {k.lower(): v for k, v in (fields.get("tags") or {}).items()}
+    
+    width, height = video.get("width") or 0, video.get("height") or 0
+    
+    # Phone recordings store portrait video as rotated landscape
+    rotation = (video.get("tags") or {}).get("rotate")
+    for side_data in video.get("side_data_list") or []:
+        rotation = side_data.get("rotation", rotation)
     try:
-        result = await cmd_exec([
-            "ffprobe", "-hide_banner", "-loglevel", "error",
-            "-print_format", "json", "-show_format", path,
-        ])
-    except Exception as e:
-        print(f"Get Media Info: {e}. Mostly File not found! - File: {path}")
-        return 0, None, None
-    
-    if result[0] and result[2] == 0:
-        fields = eval(result[0]).get("format")
-        if not fields:
-            return 0, None, None
-        duration = round(float(fields.get("duration", 0)))
-        tags = fields.get("tags", {})
-        artist = tags.get("artist") or tags.get("ARTIST") or tags.get("Artist")
-        title = tags.get("title") or tags.get("TITLE") or tags.get("Title")
-        return duration, artist, title
-    return 0, None, None
+        if abs(int(float(rotation or 0))) % 180 == 90:
+            width, height = height, width
+    except ValueError:
+        pass
+    
+    try:
+        duration = round(float(fields.get("duration") or video.get("duration") or 0))
+    except ValueError:
+        duration = 0
+    
+    return {
+        "duration": duration,
+        "width": width,
+        "height": height,
+        "video_codec": video.get("codec_name"),
+        "audio_codec": audio.get("codec_name"),
+        "bitrate": int(fields.get("bit_rate") or 0),
+        "tags": tags,
+        "artist": tags.get("artist"),
+        "title": tags.get("title"),
+    }
 
-async def split_large_video(video_path: str, progress_message) -> List[str]:
+async def _run_probe(path: str) -> dict:
+    stdout, stderr, returncode = await cmd_exec([
+        "ffprobe", "-hide_banner", "-loglevel", "error",
+        "-print_format", "json", "-show_format", "-show_streams", path,
+    ], slot="cpu", priority=PRIORITY_HIGH)
+    if returncode != 0 or not stdout:
+        raise RuntimeError(stderr or "ffprobe returned no data")
+    return _parse_probe(stdout)
+
+async def probe_media(path: str) -> dict:
     """
-    Split video larger than 2GB into parts using FFmpeg
-    Returns list of part file paths
+    Duration, width, height, codecs, bitrate and tags of a media file
+    One ffprobe per file version, concurrent callers share the same run
+    Returns an empty result if the file can't be probed
     """
+    empty = {
+        "duration": 0, "width": 0, "height": 0, "video_codec": None, "audio_codec": None,
+        "bitrate": 0, "tags": {}, "artist": None, "title": None,
+    }
     try:
-        file_size = os.path.getsize(video_path)
-        if file_size <= 2 * 1024 * 1024 * 1024:  # 2GB
-            return []
-        
-        # Get video duration
+        stat = os.stat(path)
+    except OSError as e:
+        LOGGER(__name__).error(f"Media probe: {e}")
+        return empty
+    
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    task = _media_probes.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_run_probe(path))
+        _media_probes[key] = task
+        while len(_media_probes) > MEDIA_PROBE_CACHE_SIZE:
+            _media_probes.popitem(last=False)
+    else:
+        _media_probes.move_to_end(key)
+    
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        LOGGER(__name__).error(f"Media probe failed for {path}: {e}")
+        # Don't keep failures around, the file may still be in progress
+        if _media_probes.get(key) is task:
+            del _media_probes[key]
+        return empty
+
+async def get_media_info(path):
+    info = await probe_media(path)
+    return info["duration"], info["artist"], info["title"]
+
+async def plan_video_split(video_path: str, max_part_size: int) -> List[float]:
+    """
+    Plan cut points so that every part stays under max_part_size bytes
+    Builds a packet index with ffprobe, accumulates packet sizes and cuts at the
+    last video keyframe that still fits, which gives the fewest possible parts
+    Returns cut times in seconds from the start, empty if no valid plan exists
+    """
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "packet=codec_type,pts_time,dts_time,size,flags",
+        "-of", "compact=p=0", video_path,
+    ]
+    
+    keyframes = []  # (pts_time, bytes of all packets before this keyframe)
+    total_bytes = 0
+    first_pts = None
+    
+    # Packet listings of multi-GB files are large, parse them as they stream in
+    async with media_scheduler.slot("io", PRIORITY_LOW, "ffprobe packet scan"), owned_process(
+        *cmd, stdout=PIPE, stderr=asyncio.subprocess.DEVNULL
+    ) as proc:
+        async for line in proc.stdout:
+            fields = dict(
+                item.split("=", 1) for item in line.decode(errors="ignore").strip().split("|") if "=" in item
+            )
+            try:
+                size = int(fields.get("size", 0))
+            except ValueError:
+                size = 0
+            try:
+                pts = fields.get("pts_time")
+                pts = float(pts if pts not in (None, "N/A") else fields.get("dts_time"))
+            except (TypeError, ValueError):
+                pts = None
+            
+            if pts is not None:
+                first_pts = pts if first_pts is None else min(first_pts, pts)
+                if fields.get("codec_type") == "video" and "K" in fields.get("flags", ""):
+                    keyframes.append((pts, total_bytes))
+            total_bytes += size
+        await proc.wait()
+    
+    if proc.returncode != 0 or not keyframes:
+        LOGGER(__name__).error(f"Could not build a keyframe index for {video_path}")
+        return []
+    
+    cut_times = []
+    part_start = 0  # Byte offset where the current part begins
+    candidate = None  # Last keyframe that still fits in the current part
+    
+    for pts, offset in keyframes + [(None, total_bytes)]:
+        if offset - part_start > max_part_size:
+            if candidate is None or candidate[1] <= part_start:
+                LOGGER(__name__).error("A single GOP is larger than the part size, can't plan split")
+                return []
+            cut_times.append(candidate[0] - first_pts)
+            part_start = candidate[1]
+            if offset - part_start > max_part_size:
+                LOGGER(__name__).error("A single GOP is larger than the part size, can't plan split")
+                return []
+        if pts is not None:
+            candidate = (pts, offset)
+    
+    return cut_times
+
+async def iter_split_video(video_path: str, progress_message) -> AsyncIterator[Tuple[int, int, str]]:
+    """
+    Split video larger than 2GB into parts using FFmpeg's segment muxer
+    All parts are cut in a single read pass over the input, and each one is
+    yielded as (part number, total parts, path) as soon as FFmpeg closes it,
+    so the caller can upload part i while part i+1 is being cut.
+    FFmpeg is paused while a finished part waits behind the one being uploaded,
+    so disk use stays at the source plus about two parts.
+    Yielded parts belong to the caller; parts never handed out are removed.
+    Raises RuntimeError when the video can't be split.
+    """
+    file_size = os.path.getsize(video_path)
+    
+    # Cut at keyframes chosen by size, so variable bitrate can't overflow a part
+    cut_times = await plan_video_split(video_path, PyroConf.SPLIT_PART_SIZE)
+    if cut_times:
+        num_parts = len(cut_times) + 1
+        # Nudge each cut slightly before its keyframe so float rounding can't skip it
+        segment_arg = ["-segment_times", ",".join(f"{max(t - 0.001, 0):.6f}" for t in cut_times)]
+    else:
+        # Fall back to equal durations, which assumes a constant bitrate
         duration, _, _ = await get_media_info(video_path)
         if not duration:
-            LOGGER(__name__).error("Could not get video duration for splitting")
-            return []
+            raise RuntimeError("Could not get video duration for splitting")
         
         # Calculate number of parts needed (aim for ~1.8GB per part to be safe)
         target_size = 1.8 * 1024 * 1024 * 1024  # 1.8GB
         num_parts = max(2, int((file_size / target_size) + 0.5))
-        part_duration = duration // num_parts
-        
-        LOGGER(__name__).info(f"Splitting {get_readable_file_size(file_size)} video into {num_parts} parts")
-        
-        # Get base filename without extension
-        base_name = os.path.splitext(os.path.basename(video_path))[0]
-        base_dir = os.path.dirname(video_path)
-        
-        part_paths = []
-        
-        for i in range(num_parts):
-            start_time = i * part_duration
-            
-            # For the last part, go until the end
-            if i == num_parts - 1:
-                duration_arg = []  # No duration limit for last part
-            else:
-                duration_arg = ["-t", str(part_duration)]
+        segment_arg = ["-segment_time", str(duration // num_parts)]
+    
+    LOGGER(__name__).info(f"Splitting {get_readable_file_size(file_size)} video into {num_parts} parts")
+    
+    async with aclosing(_iter_segments(video_path, segment_arg, num_parts, progress_message)) as segments:
+        async for part in segments:
+            yield part
+
+async def _iter_segments(
+    video_path: str, segment_arg: list, num_parts: int, progress_message, feed_input=None, check_size=True
+) -> AsyncIterator[Tuple[int, int, str]]:
+    """
+    Run FFmpeg's segment muxer over video_path and yield every closed segment
+    With feed_input, FFmpeg reads stdin instead and feed_input(stdin) streams the bytes;
+    such runs are paced by the download, so they don't take a scheduler slot
+    FFmpeg gets SIGSTOP while a finished part waits for the caller (giving back its
+    slot) and SIGCONT once the caller takes it
+    """
+    # Get base filename without extension
+    base_name = os.path.splitext(os.path.basename(video_path))[0]
+    base_dir = os.path.dirname(video_path)
+    
+    # '%' in the name would be read as part of the segment pattern
+    part_pattern = os.path.join(base_dir, f"{base_name.replace('%', '%%')}_part%d.mp4")
+    # FFmpeg appends each segment here once it is complete
+    list_path = os.path.join(base_dir, f"{base_name}_parts.txt")
+    
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-i", "pipe:0" if feed_input else video_path,
+        "-c", "copy",  # Copy streams without re-encoding (faster)
+        "-f", "segment",
+        *segment_arg,
+        "-segment_start_number", "1",
+        "-segment_list", list_path,
+        "-segment_list_type", "flat",
+        "-reset_timestamps", "1",
+        "-avoid_negative_ts", "make_zero",
+        "-y", part_pattern
+    ]
+    
+    await progress_message.edit(f"**✂️ Splitting video into {num_parts} parts...**")
+    
+    release = lambda: None
+    if not feed_input:
+        release = await media_scheduler.acquire("io", PRIORITY_LOW, "ffmpeg split")
+    try:
+        proc = await spawn_process(
+            *cmd,
+            stdin=PIPE if feed_input else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=PIPE,
+        )
+    except BaseException:
+        release()
+        raise
+    stderr_task = asyncio.create_task(proc.stderr.read())
+    exit_task = asyncio.create_task(proc.wait())
+    # The slot is held while FFmpeg runs, not while the caller uploads the last parts
+    exit_task.add_done_callback(lambda _: release())
+    feed_task = asyncio.create_task(feed_input(proc.stdin)) if feed_input else None
+    yielded = 0
+    consumed = 0  # Parts the caller is done with
+    paused = False
+    
+    def read_segment_list():
+        if not os.path.exists(list_path):
+            return []
+        with open(list_path) as f:
+            return [line.strip() for line in f if line.strip()]
+    
+    async def pace():
+        nonlocal paused, release
+        # One part being uploaded and one waiting is enough, hold FFmpeg there
+        while proc.returncode is None:
+            waiting = len(read_segment_list()) - consumed
+            try:
+                if waiting >= 2 and not paused:
+                    proc.send_signal(signal.SIGSTOP)
+                    paused = True
+                    release()
+                elif waiting < 2 and paused:
+                    if not feed_input:
+                        release = await media_scheduler.acquire("io", PRIORITY_LOW, "ffmpeg split")
+                    proc.send_signal(signal.SIGCONT)
+                    paused = False
+            except ProcessLookupError:
+                return
+            await asyncio.sleep(0.5)
+    
+    pace_task = asyncio.create_task(pace())
+    
+    try:
+        while True:
+            # Poll the segment list once a second until FFmpeg exits
+            await asyncio.wait({exit_task}, timeout=1)
+            exited = exit_task.done()
             
-            part_filename = f"{base_name}_part{i+1}.mp4"
-            part_path = os.path.join(base_dir, part_filename)
+            if feed_task and feed_task.done():
+                if feed_task.cancelled():
+                    raise RuntimeError("Input stream was cancelled")
+                if feed_task.exception():
+                    raise RuntimeError(f"Input stream failed: {feed_task.exception()}")
             
-            cmd = [
-                "ffmpeg", "-hide_banner", "-loglevel", "error",
-                "-ss", str(start_time), "-i", video_path,
-                *duration_arg,
-                "-c", "copy",  # Copy streams without re-encoding (faster)
-                "-avoid_negative_ts", "make_zero",
-                "-y", part_path
-            ]
+            finished = read_segment_list()
             
-            await progress_message.edit(f"**✂️ Splitting video part {i+1}/{num_parts}...**")
+            for name in finished[yielded:]:
+                part_path = os.path.join(base_dir, name)
+                part_size = os.path.getsize(part_path)
+                if part_size == 0:
+                    raise RuntimeError(f"Split part {yielded + 1} is empty")
+                if check_size and part_size > TELEGRAM_UPLOAD_LIMIT:
+                    raise RuntimeError(f"Split part {yielded + 1} is still over the upload limit")
+                
+                yielded += 1
+                LOGGER(__name__).info(f"Created part {yielded}: {name} ({get_readable_file_size(part_size)})")
+                yield yielded, max(num_parts, yielded), part_path
+                consumed = yielded
             
+            if exited:
+                break
+        
+        if proc.returncode != 0:
+            stderr = (await stderr_task).decode(errors="ignore").strip()
+            raise RuntimeError(f"FFmpeg split error: {stderr}")
+        if not yielded:
+            raise RuntimeError("Split parts were not created")
+        
+        LOGGER(__name__).info(f"Successfully split video into {yielded} parts")
+    
+    finally:
+        pace_task.cancel()
+        if paused and proc.returncode is None:
+            # A stopped process only acts on SIGTERM once it runs again
             try:
-                _, stderr, returncode = await wait_for(cmd_exec(cmd), timeout=300)  # 5 minute timeout
-                
-                if returncode != 0:
-                    LOGGER(__name__).error(f"FFmpeg split error for part {i+1}: {stderr}")
-                    # Clean up any partial files
-                    for path in part_paths:
-                        cleanup_download(path)
-                    return []
-                
-                if os.path.exists(part_path) and os.path.getsize(part_path) > 0:
-                    part_paths.append(part_path)
-                    LOGGER(__name__).info(f"Created part {i+1}: {part_filename} ({get_readable_file_size(os.path.getsize(part_path))})")
+                proc.send_signal(signal.SIGCONT)
+            except ProcessLookupError:
+                pass
+        # SIGTERM first, FFmpeg then closes the segment it is writing
+        await terminate_process(proc)
+        release()
+        for task in (exit_task, stderr_task, feed_task):
+            if task:
+                task.cancel()
+        cleanup_download(list_path)
+        
+        # Remove parts FFmpeg wrote but the caller never received
+        part_num = yielded + 1
+        while os.path.exists(os.path.join(base_dir, f"{base_name}_part{part_num}.mp4")):
+            cleanup_download(os.path.join(base_dir, f"{base_name}_part{part_num}.mp4"))
+            part_num += 1
+
+# Containers FFmpeg can demux from a pipe without seeking back for an index
+STREAMABLE_MIME_TYPES = {"video/x-matroska", "video/mp2t", "video/webm"}
+
+def can_stream_split(chat_message) -> bool:
+    """Whether an oversized Telegram video can be split while it downloads"""
+    video = chat_message.video
+    if not PyroConf.STREAM_SPLIT or not video or not video.duration:
+        return False
+    if (video.file_size or 0) <= TELEGRAM_UPLOAD_LIMIT:
+        return False
+    return bool(video.supports_streaming) or video.mime_type in STREAMABLE_MIME_TYPES
+
+async def iter_stream_split_video(
+    video_path: str, download_task, file_size: int, duration: int, progress_message
+) -> AsyncIterator[Tuple[int, Optional[int], str]]:
+    """
+    Split a video while it is still being downloaded to video_path
+    The growing file (Pyrogram writes to video_path + ".temp" first) is piped into
+    FFmpeg, so part 1 can be uploaded long before the download finishes.
+    Only works for sequentially written, streamable inputs (moov atom first, MKV, TS).
+    Cuts use the average bitrate with headroom; a part that still ends up too big
+    is split again by size once it is complete.
+    The part count is only known at the end, so parts are yielded with a total of None.
+    Raises RuntimeError when the video can't be split this way.
+    """
+    if not duration:
+        raise RuntimeError("Stream split needs the video duration")
+    
+    # Aim below the budget, the real bitrate of a part is only known afterwards
+    byte_rate = file_size / duration
+    part_duration = max(1, int(PyroConf.SPLIT_PART_SIZE * 0.85 / byte_rate))
+    num_parts = max(2, -(-duration // part_duration))
+    temp_path = video_path + ".temp"
+    
+    async def feed_input(stdin):
+        # Wait for the downloader to create the file
+        while not (os.path.exists(temp_path) or os.path.exists(video_path)):
+            if download_task.done():
+                download_task.result()
+                raise RuntimeError("Download finished without creating a file")
+            await asyncio.sleep(0.5)
+        
+        # The fd stays valid after the .temp file is renamed into place
+        fed = 0
+        with open(temp_path if os.path.exists(temp_path) else video_path, "rb") as f:
+            while True:
+                done = download_task.done()
+                chunk = await asyncio.to_thread(f.read, 4 * 1024 * 1024)
+                if chunk:
+                    stdin.write(chunk)
+                    await stdin.drain()
+                    fed += len(chunk)
+                elif done:
+                    # Pyrogram reports a failed download by returning None, not raising;
+                    # leaving stdin open keeps FFmpeg from closing a truncated last part
+                    if download_task.result() is None:
+                        raise RuntimeError("Download failed")
+                    if fed != file_size:
+                        raise RuntimeError(f"Download ended after {fed} of {file_size} bytes")
+                    break
                 else:
-                    LOGGER(__name__).error(f"Part {i+1} was not created or is empty")
-                    # Clean up any partial files
-                    for path in part_paths:
-                        cleanup_download(path)
-                    return []
-                    
-            except asyncio.TimeoutError:
-                LOGGER(__name__).error(f"Timeout while splitting part {i+1}")
-                # Clean up any partial files
-                for path in part_paths:
-                    cleanup_download(path)
-                return []
+                    await asyncio.sleep(0.5)
+        stdin.close()
+    
+    LOGGER(__name__).info(f"Stream splitting {get_readable_file_size(file_size)} video into ~{num_parts} parts")
+    
+    index = 0
+    async with aclosing(
+        _iter_segments(
+            video_path,
+            ["-segment_time", str(part_duration)],
+            num_parts,
+            progress_message,
+            feed_input=feed_input,
+            check_size=False,
+        )
+    ) as segments:
+        async for _, _, part_path in segments:
+            if os.path.getsize(part_path) <= TELEGRAM_UPLOAD_LIMIT:
+                index += 1
+                yield index, None, part_path
+                continue
+            
+            # Bitrate peak: cut this finished part again at keyframes by size
+            LOGGER(__name__).info(f"{os.path.basename(part_path)} is over the limit, splitting it again")
+            try:
+                async with aclosing(iter_split_video(part_path, progress_message)) as sub_parts:
+                    async for _, _, sub_path in sub_parts:
+                        index += 1
+                        yield index, None, sub_path
+            finally:
+                cleanup_download(part_path)
+
+async def split_large_video(video_path: str, progress_message) -> List[str]:
+    """
+    Split video larger than 2GB into parts, waiting for all of them
+    Returns list of part file paths (empty if not needed or on failure)
+    """
+    part_paths = []
+    try:
+        if os.path.getsize(video_path) <= TELEGRAM_UPLOAD_LIMIT:
+            return []
         
-        LOGGER(__name__).info(f"Successfully split video into {len(part_paths)} parts")
+        async with aclosing(iter_split_video(video_path, progress_message)) as parts:
+            async for _, _, part_path in parts:
+                part_paths.append(part_path)
         return part_paths
         
     except Exception as e:
         LOGGER(__name__).error(f"Error splitting video: {e}")
+        # Clean up any partial files
+        for path in part_paths:
+            cleanup_download(path)
         return []
 
 async def get_video_thumbnail(video_file, duration):
@@ -179,13 +548,16 @@ async def get_video_thumbnail(video_file, duration):
         "ffmpeg", "-hide_banner", "-loglevel", "error",
         "-ss", str(duration), "-i", video_file,
         "-vf", "thumbnail", "-q:v", "1", "-frames:v", "1",
-        "-threads", str(os.cpu_count() // 2), "-y", output,
+        "-threads", str(media_scheduler.threads_per_job), "-y", output,
     ]
     
     try:
-        _, err, code = await wait_for(cmd_exec(cmd, shell=False), timeout=60)
+        _, err, code = await cmd_exec(
+            cmd, shell=False, slot="cpu", priority=PRIORITY_HIGH, timeout=60
+        )
         if code != 0:
             LOGGER(__name__).error(f"FFmpeg error: {err}")
+            cleanup_download(output)
             return None
         
         if not os.path.exists(output):
@@ -200,278 +572,698 @@ async def get_video_thumbnail(video_file, duration):
             
     except Exception as e:
         LOGGER(__name__).error(f"Thumbnail generation failed: {e}")
+        cleanup_download(output)
         return None
     
     return output
 
+# Source chats the bot failed to copy from, later posts go straight to download
+COPY_FORBIDDEN_CHATS = set()
+
+# Errors that hold for the whole source chat, anything else only fails one post
+CHAT_COPY_ERRORS = {"CHAT_FORWARDS_RESTRICTED", "CHANNEL_PRIVATE", "CHAT_ADMIN_REQUIRED"}
+
+def is_copy_allowed(chat_message) -> bool:
+    """Check whether a post can be copied server-side instead of re-uploaded"""
+    if not PyroConf.COPY_MODE or not chat_message or chat_message.empty:
+        return False
+    
+    chat = chat_message.chat
+    if not chat or chat.id in COPY_FORBIDDEN_CHATS:
+        return False
+    
+    # Protected content can't be forwarded or copied, only downloaded
+    if chat_message.has_protected_content or chat.has_protected_content:
+        return False
+    
+    return True
+
+async def copy_message_to(bot, chat_message, message) -> bool:
+    """
+    Copy a post (or its whole media group) to the user without any transfer
+    Returns False when the caller has to fall back to download/upload
+    """
+    if not is_copy_allowed(chat_message):
+        return False
+    
+    chat = chat_message.chat
+    from_chat_id = chat.username or chat.id
+    
+    try:
+        if chat_message.media_group_id:
+            await bot.copy_media_group(
+                chat_id=message.chat.id,
+                from_chat_id=from_chat_id,
+                message_id=chat_message.id,
+            )
+        else:
+            await bot.copy_message(
+                chat_id=message.chat.id,
+                from_chat_id=from_chat_id,
+                message_id=chat_message.id,
+            )
+    except (BadRequest, Forbidden) as e:
+        if e.ID in CHAT_COPY_ERRORS:
+            # The bot can't see this chat or copying is restricted, remember it
+            COPY_FORBIDDEN_CHATS.add(chat.id)
+            LOGGER(__name__).info(f"Copy not possible from {chat.id}, falling back to download: {e}")
+        else:
+            LOGGER(__name__).info(f"Copy of message {chat_message.id} failed, falling back to download: {e}")
+        return False
+    except Exception as e:
+        LOGGER(__name__).error(f"Copy failed for message {chat_message.id}: {e}")
+        return False
+    
+    LOGGER(__name__).info(f"Copied message {chat_message.id} from {chat.id} server-side")
+    return True
+
+def get_part_caption(caption, index: int, total: Optional[int]) -> str:
+    """
+    Caption for part `index` of `total`, plain caption for unsplit media
+    A total of None (not known yet) labels the part by its number only
+    """
+    if total == 1:
+        return caption or ""
+    label = f"**Part {index}**" if total is None else f"**Part {index} of {total}**"
+    if caption:
+        return f"{caption}\n{label}"
+    return label
+
+def get_source_media(chat_message):
+    """Return the media object of a source post (has file_unique_id), or None"""
+    for media_type in ("photo", "video", "audio", "document", "animation", "voice", "video_note", "sticker"):
+        media = getattr(chat_message, media_type, None)
+        if media:
+            return media
+    return None
+
+def get_sent_file(sent_message) -> Optional[Tuple[str, str]]:
+    """Return (media_type, file_id) of a message the bot just sent"""
+    if not sent_message:
+        return None
+    for media_type in ("video", "audio", "photo", "document"):
+        media = getattr(sent_message, media_type, None)
+        if media:
+            return media_type, media.file_id
+    return None
+
+def remember_sent_media(source, sent_files: List[Optional[Tuple[str, str]]]) -> None:
+    """Cache the file_ids of every uploaded part of a source media"""
+    if not source or not sent_files or None in sent_files:
+        return
+    file_id_cache.put(source.file_unique_id, sent_files, getattr(source, "file_size", None))
+
+def build_cached_input_media(media_type: str, file_id: str, caption: str):
+    """InputMedia for a media group item that is sent by reference"""
+    if media_type == "photo":
+        return InputMediaPhoto(media=file_id, caption=caption)
+    if media_type == "video":
+        return InputMediaVideo(media=file_id, caption=caption)
+    if media_type == "audio":
+        return InputMediaAudio(media=file_id, caption=caption)
+    return InputMediaDocument(media=file_id, caption=caption)
+
+async def send_cached_media(message, chat_message, caption) -> bool:
+    """
+    Re-send a previously uploaded source media by file_id, without any transfer
+    Returns False on cache miss or when the cached file_ids are no longer valid
+    """
+    source = get_source_media(chat_message)
+    if not source:
+        return False
+    
+    cached = file_id_cache.get(source.file_unique_id)
+    if not cached:
+        return False
+    
+    try:
+        for i, (_, file_id) in enumerate(cached, 1):
+            await message.reply_cached_media(
+                file_id, caption=get_part_caption(caption, i, len(cached))
+            )
+    except (BadRequest, Forbidden) as e:
+        LOGGER(__name__).info(f"Cached file_id rejected, uploading again: {e}")
+        file_id_cache.invalidate(source.file_unique_id)
+        return False
+    
+    return True
+
+async def download_media_file(chat_message, file_name, progress=None, progress_args=(), sequential=False):
+    """
+    Download the media of a post with the engine selected by DOWNLOAD_ENGINE
+    sequential=True forces the default engine, which writes the file front to back
+    """
+    media = get_source_media(chat_message)
+    
+    if (
+        not sequential
+        and PyroConf.DOWNLOAD_ENGINE == "parallel"
+        and media
+        and (media.file_size or 0) >= PARALLEL_MIN_SIZE
+    ):
+        try:
+            return await parallel_download(
+                chat_message._client,
+                media,
+                file_name,
+                connections=PyroConf.DOWNLOAD_CONNECTIONS,
+                progress=progress,
+                progress_args=progress_args,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            LOGGER(__name__).warning(f"Parallel download failed, using default engine: {e}")
+    
+    return await chat_message.download(
+        file_name=file_name,
+        progress=progress,
+        progress_args=progress_args,
+    )
+
 # Generate progress bar for downloading/uploading
 def progressArgs(action: str, progress_message, start_time):
     return (action, progress_message, start_time, PROGRESS_BAR, "▓", "░")
 
-async def processMediaGroup(chat_message, bot, message):
-    media_group_messages = await chat_message.get_media_group()
-    valid_media = []
-    temp_paths = []
-    invalid_paths = []
-    thumbnail_paths = []  # Track thumbnail paths for cleanup
+async def prepare_group_item(msg, i, total, message, progress_message, start_time) -> dict:
+    """
+    Download and prepare one album item
+    Returns its InputMedia entries, their cache keys and the files to clean up afterwards
+    """
+    item = {"media": [], "keys": [], "temp_paths": [], "invalid_paths": [], "thumbnail_paths": []}
+    valid_media = item["media"]
+    media_keys = item["keys"]  # Source media of each entry, None if sent by reference
+    temp_paths = item["temp_paths"]
+    invalid_paths = item["invalid_paths"]
+    thumbnail_paths = item["thumbnail_paths"]
     
-    start_time = time()
-    progress_message = await message.reply("📥 Downloading media group...")
+    if not (msg.photo or msg.video or msg.document or msg.audio):
+        return item
     
-    LOGGER(__name__).info(
-        f"Downloading media group with {len(media_group_messages)} items..."
-    )
+    source = get_source_media(msg)
     
-    # Process each media item sequentially to avoid conflicts
-    for i, msg in enumerate(media_group_messages):
-        if msg.photo or msg.video or msg.document or msg.audio:
-            media_path = None
-            try:
-                LOGGER(__name__).info(f"Processing media {i+1}/{len(media_group_messages)}")
-                
-                # Generate unique filename for each media item
-                from helpers.files import get_download_path
-                from helpers.msg import get_file_name
-                
-                base_filename = get_file_name(msg.id, msg)  # Use individual message ID
-                
-                # Add index to filename to ensure uniqueness
-                name, ext = os.path.splitext(base_filename)
-                if not ext:
-                    # Determine extension based on media type
-                    if msg.video:
-                        ext = ".mp4"
-                    elif msg.photo:
-                        ext = ".jpg"
-                    elif msg.audio:
-                        ext = ".mp3"
-                    elif msg.document:
-                        ext = msg.document.mime_type.split('/')[-1] if msg.document.mime_type else ""
-                        if not ext.startswith('.'):
-                            ext = f".{ext}" if ext else ""
-                
-                unique_filename = f"{name}_item{i+1}{ext}"
-                download_path = get_download_path(message.id, unique_filename)
-                
-                media_path = await msg.download(
-                    file_name=download_path,
-                    progress=Leaves.progress_for_pyrogram,
-                    progress_args=progressArgs(
-                        f"📥 Downloading Progress ({i+1}/{len(media_group_messages)})",
-                        progress_message,
-                        start_time
+    # Items uploaded before are sent by file_id without downloading
+    cached = file_id_cache.get(source.file_unique_id)
+    if cached:
+        caption = await get_parsed_msg(msg.caption or "", msg.caption_entities)
+        for j, (media_type, file_id) in enumerate(cached, 1):
+            valid_media.append(
+                build_cached_input_media(
+                    media_type, file_id, get_part_caption(caption, j, len(cached))
+                )
+            )
+            media_keys.append(None)
+        return item
+    
+    media_path = None
+    first_index = len(valid_media)
+    try:
+        LOGGER(__name__).info(f"Processing media {i+1}/{total}")
+        
+        # Generate unique filename for each media item
+        from helpers.files import get_download_path
+        from helpers.msg import get_file_name
+        
+        base_filename = get_file_name(msg.id, msg)  # Use individual message ID
+        
+        # Add index to filename to ensure uniqueness
+        name, ext = os.path.splitext(base_filename)
+        if not ext:
+            # Determine extension based on media type
+            if msg.video:
+                ext = ".mp4"
+            elif msg.photo:
+                ext = ".jpg"
+            elif msg.audio:
+                ext = ".mp3"
+            elif msg.document:
+                ext = msg.document.mime_type.split('/')[-1] if msg.document.mime_type else ""
+                if not ext.startswith('.'):
+                    ext = f".{ext}" if ext else ""
+        
+        unique_filename = f"{name}_item{i+1}{ext}"
+        download_path = get_download_path(message.id, unique_filename)
+        
+        media_path = await download_media_file(
+            msg,
+            download_path,
+            progress=Leaves.progress_for_pyrogram,
+            progress_args=progressArgs(
+                f"📥 Downloading Progress ({i+1}/{total})",
+                progress_message,
+                start_time
+            ),
+        )
+        temp_paths.append(media_path)
+        LOGGER(__name__).info(f"Downloaded: {media_path}")
+        
+        if msg.photo:
+            valid_media.append(
+                InputMediaPhoto(
+                    media=media_path,
+                    caption=await get_parsed_msg(
+                        msg.caption or "", msg.caption_entities
                     ),
                 )
-                temp_paths.append(media_path)
-                LOGGER(__name__).info(f"Downloaded: {media_path}")
+            )
+        elif msg.video:
+            # Check if video needs splitting
+            file_size = os.path.getsize(media_path)
+            if file_size > TELEGRAM_UPLOAD_LIMIT:
+                LOGGER(__name__).info(f"Video {i+1} is larger than 2GB, splitting...")
+                await progress_message.edit(f"**✂️ Splitting large video {i+1}...**")
                 
-                if msg.photo:
-                    valid_media.append(
-                        InputMediaPhoto(
-                            media=media_path,
-                            caption=await get_parsed_msg(
-                                msg.caption or "", msg.caption_entities
-                            ),
-                        )
-                    )
-                elif msg.video:
-                    # Check if video needs splitting
-                    file_size = os.path.getsize(media_path)
-                    if file_size > 2 * 1024 * 1024 * 1024:  # 2GB
-                        LOGGER(__name__).info(f"Video {i+1} is larger than 2GB, splitting...")
-                        await progress_message.edit(f"**✂️ Splitting large video {i+1}...**")
-                        
-                        split_paths = await split_large_video(media_path, progress_message)
-                        if split_paths:
-                            # Add each part as separate media
-                            for j, part_path in enumerate(split_paths, 1):
-                                temp_paths.append(part_path)
-                                duration = (await get_media_info(part_path))[0]
-                                thumb = await get_video_thumbnail(part_path, duration)
-                                if thumb and os.path.exists(thumb):
-                                    thumbnail_paths.append(thumb)
-                                    with Image.open(thumb) as img:
-                                        width, height = img.size
-                                else:
-                                    width, height = 480, 320
-                                    thumb = None
-                                
-                                part_caption = f"{await get_parsed_msg(msg.caption or '', msg.caption_entities) or ''}\n**Part {j} of {len(split_paths)}**"
-                                
-                                valid_media.append(
-                                    InputMediaVideo(
-                                        media=part_path,
-                                        thumb=thumb,
-                                        width=width,
-                                        height=height,
-                                        duration=duration,
-                                        caption=part_caption,
-                                    )
-                                )
-                        else:
-                            # Fallback to original if splitting failed
-                            LOGGER(__name__).info(f"Generating thumbnail for video {i+1}")
-                            duration = (await get_media_info(media_path))[0]
-                            thumb = await get_video_thumbnail(media_path, duration)
-                            if thumb and os.path.exists(thumb):
-                                thumbnail_paths.append(thumb)
-                                with Image.open(thumb) as img:
-                                    width, height = img.size
-                            else:
-                                width, height = 480, 320
-                                thumb = None
-                            
-                            valid_media.append(
-                                InputMediaVideo(
-                                    media=media_path,
-                                    thumb=thumb,
-                                    width=width,
-                                    height=height,
-                                    duration=duration,
-                                    caption=await get_parsed_msg(
-                                        msg.caption or "", msg.caption_entities
-                                    ),
-                                )
-                            )
-                    else:
-                        LOGGER(__name__).info(f"Generating thumbnail for video {i+1}")
-                        duration = (await get_media_info(media_path))[0]
-                        thumb = await get_video_thumbnail(media_path, duration)
+                split_paths = await split_large_video(media_path, progress_message)
+                if split_paths:
+                    # Only the parts are sent, free the original right away
+                    temp_paths.remove(media_path)
+                    cleanup_download(media_path)
+                    
+                    # Add each part as separate media
+                    for j, part_path in enumerate(split_paths, 1):
+                        temp_paths.append(part_path)
+                        info = await probe_media(part_path)
+                        duration = info["duration"]
+                        width, height = info["width"] or 480, info["height"] or 320
+                        thumb = await get_video_thumbnail(part_path, duration)
                         if thumb and os.path.exists(thumb):
                             thumbnail_paths.append(thumb)
-                            try:
-                                with Image.open(thumb) as img:
-                                    width, height = img.size
-                            except Exception as img_error:
-                                LOGGER(__name__).error(f"Error reading thumbnail dimensions: {img_error}")
-                                width, height = 480, 320
                         else:
-                            width = 480
-                            height = 320
                             thumb = None
                         
-                        LOGGER(__name__).info(f"Video {i+1}: thumb={thumb}, duration={duration}, size={width}x{height}")
+                        part_caption = get_part_caption(
+                            await get_parsed_msg(msg.caption or "", msg.caption_entities),
+                            j,
+                            len(split_paths),
+                        )
                         
                         valid_media.append(
                             InputMediaVideo(
-                                media=media_path,
+                                media=part_path,
                                 thumb=thumb,
                                 width=width,
                                 height=height,
                                 duration=duration,
-                                caption=await get_parsed_msg(
-                                    msg.caption or "", msg.caption_entities
-                                ),
+                                caption=part_caption,
                             )
                         )
-                elif msg.document:
-                    valid_media.append(
-                        InputMediaDocument(
-                            media=media_path,
-                            caption=await get_parsed_msg(
-                                msg.caption or "", msg.caption_entities
-                            ),
-                        )
-                    )
-                elif msg.audio:
-                    duration, artist, title = await get_media_info(media_path)
+                else:
+                    # Fallback to original if splitting failed
+                    LOGGER(__name__).info(f"Generating thumbnail for video {i+1}")
+                    duration, width, height, thumb = await get_video_attributes(media_path, msg)
+                    if thumb and os.path.exists(thumb):
+                        thumbnail_paths.append(thumb)
+                    else:
+                        thumb = None
+                    
                     valid_media.append(
-                        InputMediaAudio(
+                        InputMediaVideo(
                             media=media_path,
+                            thumb=thumb,
+                            width=width,
+                            height=height,
                             duration=duration,
-                            performer=artist,
-                            title=title,
                             caption=await get_parsed_msg(
                                 msg.caption or "", msg.caption_entities
                             ),
                         )
                     )
-            except Exception as e:
-                LOGGER(__name__).error(f"Error processing media {i+1}: {e}")
-                if media_path and os.path.exists(media_path):
-                    invalid_paths.append(media_path)
-                continue
+            else:
+                duration, width, height, thumb = await get_video_attributes(media_path, msg)
+                if thumb and os.path.exists(thumb):
+                    thumbnail_paths.append(thumb)
+                else:
+                    thumb = None
+                
+                LOGGER(__name__).info(f"Video {i+1}: thumb={thumb}, duration={duration}, size={width}x{height}")
+                
+                valid_media.append(
+                    InputMediaVideo(
+                        media=media_path,
+                        thumb=thumb,
+                        width=width,
+                        height=height,
+                        duration=duration,
+                        caption=await get_parsed_msg(
+                            msg.caption or "", msg.caption_entities
+                        ),
+                    )
+                )
+        elif msg.document:
+            valid_media.append(
+                InputMediaDocument(
+                    media=media_path,
+                    caption=await get_parsed_msg(
+                        msg.caption or "", msg.caption_entities
+                    ),
+                )
+            )
+        elif msg.audio:
+            duration, artist, title = await get_media_info(media_path)
+            valid_media.append(
+                InputMediaAudio(
+                    media=media_path,
+                    duration=duration,
+                    performer=artist,
+                    title=title,
+                    caption=await get_parsed_msg(
+                        msg.caption or "", msg.caption_entities
+                    ),
+                )
+            )
+        
+        media_keys.extend([source] * (len(valid_media) - first_index))
+    except Exception as e:
+        # Keep keys aligned, but never cache an item that was only partly prepared
+        media_keys.extend([None] * (len(valid_media) - first_index))
+        LOGGER(__name__).error(f"Error processing media {i+1}: {e}")
+        if media_path and os.path.exists(media_path):
+            invalid_paths.append(media_path)
+    
+    return item
+
+async def preupload_group_entry(bot, peer, entry, progress_message=None):
+    """
+    Upload the local file of a video, document or audio album entry with
+    messages.UploadMedia and point the entry at the resulting file_id instead
+    Photos are small and keep their path
+    """
+    if isinstance(entry, InputMediaPhoto) or not isinstance(entry.media, str):
+        return entry
+    if not os.path.isfile(entry.media):
+        return entry  # Already a file_id
+    
+    path = entry.media
+    file_name = os.path.basename(path)
+    mime_type = guess_type(file_name)[0]
+    thumb = None
+    
+    if isinstance(entry, InputMediaVideo):
+        file_type = FileType.VIDEO
+        mime_type = mime_type or "video/mp4"
+        thumb = entry.thumb
+        attributes = [
+            raw.types.DocumentAttributeVideo(
+                supports_streaming=True,
+                duration=entry.duration or 0,
+                w=entry.width or 0,
+                h=entry.height or 0,
+            )
+        ]
+    elif isinstance(entry, InputMediaAudio):
+        file_type = FileType.AUDIO
+        mime_type = mime_type or "audio/mpeg"
+        attributes = [
+            raw.types.DocumentAttributeAudio(
+                duration=entry.duration or 0,
+                performer=entry.performer,
+                title=entry.title,
+            )
+        ]
+    else:
+        file_type = FileType.DOCUMENT
+        mime_type = mime_type or "application/zip"
+        attributes = []
+    attributes.append(raw.types.DocumentAttributeFilename(file_name=file_name))
     
-    LOGGER(__name__).info(f"Valid media count: {len(valid_media)}")
+    progress_kwargs = {}
+    if progress_message:
+        progress_kwargs = {
+            "progress": Leaves.progress_for_pyrogram,
+            "progress_args": progressArgs(f"📤 Uploading {file_name}", progress_message, time()),
+        }
+    
+    uploaded = await bot.invoke(
+        raw.functions.messages.UploadMedia(
+            peer=peer,
+            media=raw.types.InputMediaUploadedDocument(
+                file=await bot.save_file(path, **progress_kwargs),
+                thumb=await bot.save_file(thumb) if thumb else None,
+                mime_type=mime_type,
+                attributes=attributes,
+            ),
+        )
+    )
+    document = uploaded.document
+    entry.media = FileId(
+        file_type=file_type,
+        dc_id=document.dc_id,
+        media_id=document.id,
+        access_hash=document.access_hash,
+        file_reference=document.file_reference,
+    ).encode()
+    return entry
+
+async def upload_stream_document(bot, peer, part: StreamRange, progress_message=None) -> str:
+    """
+    Upload one StreamRange as a document with messages.UploadMedia
+    Returns its file_id, ready to be sent with reply_document
+    """
+    progress_kwargs = {}
+    if progress_message:
+        progress_kwargs = {
+            "progress": Leaves.progress_for_pyrogram,
+            "progress_args": progressArgs(f"📤 Uploading {part.name}", progress_message, time()),
+        }
     
-    if valid_media:
+    uploaded = await bot.invoke(
+        raw.functions.messages.UploadMedia(
+            peer=peer,
+            media=raw.types.InputMediaUploadedDocument(
+                file=await parallel_save_file(bot, part, PyroConf.UPLOAD_CONNECTIONS, **progress_kwargs),
+                mime_type=guess_type(part.name)[0] or "application/octet-stream",
+                attributes=[raw.types.DocumentAttributeFilename(file_name=part.name)],
+                force_file=True,
+            ),
+        )
+    )
+    document = uploaded.document
+    return FileId(
+        file_type=FileType.DOCUMENT,
+        dc_id=document.dc_id,
+        media_id=document.id,
+        access_hash=document.access_hash,
+        file_reference=document.file_reference,
+    ).encode()
+
+async def send_media_individually(bot, chat_id, entry):
+    """Send one InputMedia on its own, returns the sent message"""
+    if isinstance(entry, InputMediaPhoto):
+        return await bot.send_photo(
+            chat_id=chat_id,
+            photo=entry.media,
+            caption=entry.caption,
+        )
+    elif isinstance(entry, InputMediaVideo):
+        return await bot.send_video(
+            chat_id=chat_id,
+            video=entry.media,
+            thumb=entry.thumb,
+            width=entry.width,
+            height=entry.height,
+            duration=entry.duration,
+            caption=entry.caption,
+        )
+    elif isinstance(entry, InputMediaDocument):
+        return await bot.send_document(
+            chat_id=chat_id,
+            document=entry.media,
+            caption=entry.caption,
+        )
+    elif isinstance(entry, InputMediaAudio):
+        return await bot.send_audio(
+            chat_id=chat_id,
+            audio=entry.media,
+            duration=entry.duration,
+            performer=entry.performer,
+            title=entry.title,
+            caption=entry.caption,
+        )
+
+async def send_album(bot, chat_id, media: list) -> list:
+    """
+    Send InputMedia as an album, halving it on every rejection until single
+    entries are sent on their own
+    Returns the sent message for every entry, None where sending failed
+    """
+    if len(media) == 1:
         try:
-            LOGGER(__name__).info("Sending media group...")
-            
-            # If media group is too large, send in chunks of 10 (Telegram limit)
-            chunk_size = 10
-            for i in range(0, len(valid_media), chunk_size):
-                chunk = valid_media[i:i + chunk_size]
-                await bot.send_media_group(chat_id=message.chat.id, media=chunk)
-                if i + chunk_size < len(valid_media):
-                    await asyncio.sleep(1)  # Small delay between chunks
-            
-            LOGGER(__name__).info("Media group sent successfully")
-            await progress_message.delete()
-            
+            return [await send_media_individually(bot, chat_id, media[0])]
         except Exception as e:
-            LOGGER(__name__).error(f"Failed to send media group: {e}")
-            await message.reply(
-                "**❌ Failed to send media group, trying individual uploads**"
-            )
+            LOGGER(__name__).error(f"Failed to upload individual media: {e}")
+            return [None]
+    
+    try:
+        sent_messages = await bot.send_media_group(chat_id=chat_id, media=media)
+        return sent_messages + [None] * (len(media) - len(sent_messages))
+    except Exception as e:
+        LOGGER(__name__).error(f"Failed to send media group of {len(media)}: {e}")
+    
+    await asyncio.sleep(1)  # Small delay before the retries
+    half = (len(media) + 1) // 2
+    return await send_album(bot, chat_id, media[:half]) + await send_album(bot, chat_id, media[half:])
+
+async def send_group_chunk(bot, message, media: list, progress_message=None) -> list:
+    """
+    Send up to 10 InputMedia as one album
+    Big local files are uploaded once up front, so retrying a rejected album in
+    smaller groups or one by one sends them by reference instead of re-uploading
+    Returns the sent message for every entry, None where sending failed
+    """
+    peer = await bot.resolve_peer(message.chat.id)
+    for i, entry in enumerate(media):
+        try:
+            await preupload_group_entry(bot, peer, entry, progress_message)
+        except Exception as e:
+            # Left as a path, send_media_group uploads it itself
+            LOGGER(__name__).error(f"Pre-upload of media {i+1} failed: {e}")
+    
+    return await send_album(bot, message.chat.id, media)
+
+def finish_group_item(item: dict) -> None:
+    """Cache an album item if every part of it was sent, then remove its files"""
+    keys = item["keys"]
+    if keys and all(keys) and len(item["sent"]) == len(keys):
+        remember_sent_media(keys[0], item["sent"])
+    
+    for path in item["temp_paths"] + item["invalid_paths"] + item["thumbnail_paths"]:
+        cleanup_download(path)
+
+async def processMediaGroup(chat_message, bot, message):
+    media_group_messages = await chat_message.get_media_group()
+    total = len(media_group_messages)
+    chunk_size = 10  # Telegram limit per media group
+    
+    start_time = time()
+    progress_message = await message.reply("📥 Downloading media group...")
+    
+    LOGGER(__name__).info(
+        f"Downloading media group with {total} items..."
+    )
+    
+    # Items download concurrently and each is prepared as soon as it lands
+    semaphore = asyncio.Semaphore(PyroConf.GROUP_CONCURRENCY)
+    
+    async def prepare(i, msg):
+        async with semaphore:
+            return await prepare_group_item(msg, i, total, message, progress_message, start_time)
+    
+    # Preparation runs at most one chunk of items ahead of the chunk being sent,
+    # so only about two chunks of files are on disk at a time
+    tasks = {}  # Album index -> prepare task
+    open_items = {}  # Prepared items whose entries aren't all sent yet
+    pending = []  # (item, InputMedia, source) waiting to be sent, in album order
+    sent_count = 0
+    
+    def finish(item):
+        open_items.pop(id(item), None)
+        finish_group_item(item)
+    
+    async def send_chunk(chunk):
+        nonlocal sent_count
+        sent_messages = await send_group_chunk(
+            bot, message, [media for _, media, _ in chunk], progress_message
+        )
+        for (item, _, source), sent_message in zip(chunk, sent_messages):
+            if sent_message and source:
+                item["sent"].append(get_sent_file(sent_message))
+            item["unsent"] -= 1
+            if item["unsent"] == 0:
+                finish(item)
+        sent_count += len(chunk)
+    
+    try:
+        for i in range(total):
+            for j in range(i, min(i + chunk_size + 1, total)):
+                if j not in tasks:
+                    tasks[j] = asyncio.create_task(prepare(j, media_group_messages[j]))
             
-            # Send each media individually with proper parameters
-            for i, media in enumerate(valid_media):
-                try:
-                    LOGGER(__name__).info(f"Sending individual media {i+1}/{len(valid_media)}")
-                    if isinstance(media, InputMediaPhoto):
-                        await bot.send_photo(
-                            chat_id=message.chat.id,
-                            photo=media.media,
-                            caption=media.caption,
-                        )
-                    elif isinstance(media, InputMediaVideo):
-                        await bot.send_video(
-                            chat_id=message.chat.id,
-                            video=media.media,
-                            thumb=media.thumb,
-                            width=media.width,
-                            height=media.height,
-                            duration=media.duration,
-                            caption=media.caption,
-                        )
-                    elif isinstance(media, InputMediaDocument):
-                        await bot.send_document(
-                            chat_id=message.chat.id,
-                            document=media.media,
-                            caption=media.caption,
-                        )
-                    elif isinstance(media, InputMediaAudio):
-                        await bot.send_audio(
-                            chat_id=message.chat.id,
-                            audio=media.media,
-                            duration=media.duration,
-                            performer=media.performer,
-                            title=media.title,
-                            caption=media.caption,
-                        )
-                    await asyncio.sleep(0.5)  # Small delay between individual sends
-                except Exception as individual_e:
-                    LOGGER(__name__).error(f"Failed to upload individual media {i+1}: {individual_e}")
+            item = await tasks.pop(i)
+            item["sent"] = []  # (media_type, file_id) of the parts sent so far
+            item["unsent"] = len(item["media"])
+            open_items[id(item)] = item
+            if not item["media"]:
+                finish(item)
+            pending.extend(zip([item] * len(item["media"]), item["media"], item["keys"]))
             
-            await progress_message.delete()
-        
-        # Cleanup all downloaded files and thumbnails
-        LOGGER(__name__).info(f"Cleaning up {len(temp_paths + invalid_paths + thumbnail_paths)} files")
-        for path in temp_paths + invalid_paths + thumbnail_paths:
-            cleanup_download(path)
-        
-        return True
+            while len(pending) >= chunk_size or (i == total - 1 and pending):
+                chunk, pending = pending[:chunk_size], pending[chunk_size:]
+                LOGGER(__name__).info(f"Sending media group chunk of {len(chunk)}...")
+                await send_chunk(chunk)
+                if pending or i < total - 1:
+                    await asyncio.sleep(1)  # Small delay between chunks
+    finally:
+        # Cancelled or failed midway: drop the files of everything not sent
+        for task in tasks.values():
+            task.cancel()
+        for item in await asyncio.gather(*tasks.values(), return_exceptions=True):
+            if isinstance(item, dict):
+                finish_group_item(item)
+        for item in list(open_items.values()):
+            finish(item)
     
     await progress_message.delete()
+    
+    if sent_count:
+        LOGGER(__name__).info("Media group sent successfully")
+        return True
+    
     await message.reply("❌ No valid media found in the media group.")
-    for path in invalid_paths + thumbnail_paths:
-        cleanup_download(path)
     return False
 
+async def download_source_thumbnail(source_message) -> Optional[str]:
+    """Download the largest Telegram thumbnail of a source video, None if it has none"""
+    video = source_message.video
+    if not video or not video.thumbs:
+        return None
+    
+    os.makedirs("Assets", exist_ok=True)
+    output = os.path.join("Assets", f"thumb_{uuid.uuid4()}.jpg")
+    try:
+        path = await source_message._client.download_media(
+            video.thumbs[-1].file_id, file_name=output
+        )
+    except Exception as e:
+        LOGGER(__name__).error(f"Source thumbnail download failed: {e}")
+        return None
+    
+    if not path or not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    return path
+
+async def get_video_attributes(media_path: str, source_message=None, thumb=None):
+    """
+    Duration, width, height and thumbnail path to upload a video with
+    Taken from the source Telegram video when it has them, ffprobe/ffmpeg on
+    the local file only fill in what is missing
+    `thumb` is a source thumbnail fetched beforehand, so none is downloaded here
+    """
+    video = getattr(source_message, "video", None)
+    duration = width = height = 0
+    
+    if video:
+        duration, width, height = video.duration or 0, video.width or 0, video.height or 0
+        thumb = thumb or await download_source_thumbnail(source_message)
+    
+    if not (duration and width and height):
+        info = await probe_media(media_path)
+        duration = duration or info["duration"]
+        width = width or info["width"]
+        height = height or info["height"]
+    
+    if not thumb:
+        thumb = await get_video_thumbnail(media_path, duration)
+    
+    return duration, width or 480, height or 320, thumb
+
 async def send_media(
-    bot, message, media_path, media_type, caption, progress_message, start_time
+    bot, message, media_path, media_type, caption, progress_message, start_time, source=None, thumb=None
 ):
+    """
+    Upload a local file as reply, returns the sent message (None if rejected)
+    `source` is the Telegram message the file is a full copy of, its video metadata is reused
+    `thumb` is its thumbnail if already downloaded, it is removed after the upload
+    """
     file_size = os.path.getsize(media_path)
     if not await fileSizeLimit(file_size, message, "upload"):
         return
@@ -479,8 +1271,9 @@ async def send_media(
     progress_args = progressArgs("📥 Uploading Progress", progress_message, start_time)
     LOGGER(__name__).info(f"Uploading media: {media_path} ({media_type})")
     
+    sent = None
     if media_type == "photo":
-        await message.reply_photo(
+        sent = await message.reply_photo(
             media_path,
             caption=caption or "",
             progress=Leaves.progress_for_pyrogram,
@@ -492,37 +1285,30 @@ async def send_media(
         if os.path.exists(old_thumb_pattern):
             os.remove(old_thumb_pattern)
         
-        duration = (await get_media_info(media_path))[0]
-        thumb = await get_video_thumbnail(media_path, duration)
-        
-        if thumb is not None and thumb != "none":
-            with Image.open(thumb) as img:
-                width, height = img.size
-        else:
-            width = 480
-            height = 320
+        duration, width, height, thumb = await get_video_attributes(media_path, source, thumb)
         
         if thumb == "none":
             thumb = None
         
-        await message.reply_video(
-            media_path,
-            duration=duration,
-            width=width,
-            height=height,
-            thumb=thumb,
-            caption=caption or "",
-            progress=Leaves.progress_for_pyrogram,
-            progress_args=progress_args,
-        )
-        
-        # Clean up the unique thumbnail after upload
-        if thumb and os.path.exists(thumb):
-            cleanup_download(thumb)
+        try:
+            sent = await message.reply_video(
+                media_path,
+                duration=duration,
+                width=width,
+                height=height,
+                thumb=thumb,
+                caption=caption or "",
+                progress=Leaves.progress_for_pyrogram,
+                progress_args=progress_args,
+            )
+        finally:
+            # Clean up the unique thumbnail after upload
+            if thumb and os.path.exists(thumb):
+                cleanup_download(thumb)
             
     elif media_type == "audio":
         duration, artist, title = await get_media_info(media_path)
-        await message.reply_audio(
+        sent = await message.reply_audio(
             media_path,
             duration=duration,
             performer=artist,
@@ -532,9 +1318,11 @@ async def send_media(
             progress_args=progress_args,
         )
     elif media_type == "document":
-        await message.reply_document(
+        sent = await message.reply_document(
             media_path,
             caption=caption or "",
             progress=Leaves.progress_for_pyrogram,
             progress_args=progress_args,
-        )
\ No newline at end of file
+        )
+    
+    return sent
@@ -6,6 +6,7 @@ import shutil
 import psutil
 import asyncio
 from time import time
+from contextlib import aclosing
 from pyleaves import Leaves
 from pyrogram.enums import ParseMode
 from pyrogram import Client, filters
@@ -14,15 +15,32 @@ from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 from helpers.utils import (
     processMediaGroup,
     progressArgs,
+    copy_message_to,
+    download_media_file,
+    send_cached_media,
+    get_source_media,
+    get_sent_file,
+    get_part_caption,
+    remember_sent_media,
     send_media,
-    split_large_video  # New function for video splitting
+    iter_split_video,
+    iter_stream_split_video,
+    can_stream_split,
+    probe_media,
+    get_video_thumbnail,
+    upload_stream_document,
+    download_source_thumbnail,
+    TELEGRAM_UPLOAD_LIMIT
 )
 from helpers.files import (
     get_download_path,
     fileSizeLimit,
     get_readable_file_size,
     get_readable_time,
-    cleanup_download
+    cleanup_download,
+    DiskBudget,
+    DiskSpace,
+    FileRange
 )
 from helpers.msg import (
     getChatMsgID,
@@ -30,6 +48,12 @@ from helpers.msg import (
     get_parsed_msg
 )
 from helpers.telethon_client import telethon_handler  # New import
+from helpers.cache import file_id_cache
+from helpers.scheduler import media_scheduler
+from helpers.processes import terminate_all_processes, TERMINATE_GRACE
+from helpers.transfer import enable_parallel_upload, PARALLEL_MIN_SIZE
+from helpers.streaming import HttpRangeStream, StreamRange
+from helpers.aria2 import aria2_daemon
 from config import PyroConf
 from logger import LOGGER
 
@@ -37,7 +61,7 @@ from helpers.downloaders import (
     save_cookies,
     aria2c_download,
     ytdlp_download,
-    split_file_p7zip
+    probe_url
 )
 
 
@@ -49,13 +73,33 @@ bot = Client(
     bot_token=PyroConf.BOT_TOKEN,
     workers=1000,
     parse_mode=ParseMode.MARKDOWN,
+    # Pyrogram allows one save_file/get_file at a time unless told otherwise
+    max_concurrent_transmissions=PyroConf.UPLOAD_TRANSMISSIONS,
 )
 
 # Client for user session
-user = Client("user_session", workers=1000, session_string=PyroConf.SESSION_STRING)
+user = Client(
+    "user_session",
+    workers=1000,
+    session_string=PyroConf.SESSION_STRING,
+    max_concurrent_transmissions=PyroConf.DOWNLOAD_TRANSMISSIONS,
+)
+
+# Big uploads over several connections instead of one
+if PyroConf.UPLOAD_ENGINE == "parallel":
+    enable_parallel_upload(bot, PyroConf.UPLOAD_CONNECTIONS)
 
 RUNNING_TASKS = set()
 
+# Maximum number of message IDs Telegram accepts in a single get_messages call
+MESSAGES_FETCH_LIMIT = 200
+
+# Size of the raw volumes files over 2GB are sent as
+VOLUME_SIZE = 1900 * 1024 * 1024
+
+# Disk space promised to /l downloads whose size the server told us up front
+url_disk_space = DiskSpace(".", PyroConf.URL_DISK_MARGIN)
+
 def track_task(coro):
     task = asyncio.create_task(coro)
     RUNNING_TASKS.add(task)
@@ -86,8 +130,7 @@ async def start(_, message: Message):
 from helpers.downloaders import (
     save_cookies,
     aria2c_download,
-    ytdlp_download,
-    split_file_p7zip
+    ytdlp_download
 )
 
 @bot.on_message(filters.command("ck") & filters.private)
@@ -119,129 +162,144 @@ async def aria2c_download_command(bot: Client, message: Message):
             "Download files using aria2c:\n"
             "`/l URL` or `/l URL1 URL2 ...`\n\n"
             "Features:\n"
-            "• 16 connections per server\n"
+            "• Shared aria2c daemon with a global connection budget\n"
             "• Auto-split large files\n"
-            "• Files >2GB will be split with 7zip"
+            "• Files >2GB are sent as .001, .002, ... parts\n"
+            "• `/pause GID` and `/resume GID` with the id shown in the status"
         )
         return
     
     urls_text = message.text.split(None, 1)[1]
     urls = urls_text.split()
     
-    progress_message = await message.reply("**🔍 Processing download links...**")
+    # Tracked so /killall can stop it along with its aria2c processes
+    await track_task(_aria2c_download_urls(bot, message, urls))
+
+async def _aria2c_download_urls(bot: Client, message: Message, urls: list):
+    from urllib.parse import urlparse, unquote
+    from helpers.downloaders import is_video_file
+    
+    # Paths holding a disk reservation, all released once the command is over
+    reserved = set()
+    
+    async def release(path):
+        reserved.discard(path)
+        await url_disk_space.release(path)
+    
+    async def download(i, url, status):
+        # Ask the server for size and name before committing disk space
+        await status.edit("🔎 Probing")
+        info = await probe_url(url) or {}
+        size = info.get("size")
+        
+        # Generate unique filename
+        import datetime
+        parsed_url = urlparse(url)
+        filename = (
+            info.get("file_name")
+            or unquote(os.path.basename(parsed_url.path))
+            or f"download_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        )
+        # Every link gets its own folder, so equal file names can't collide
+        download_path = get_download_path(f"{message.id}_{i}", filename)
+        
+        # Big non-video files can go from the server to Telegram without touching
+        # the disk, videos still land there to be probed, thumbnailed and split
+        if (
+            PyroConf.URL_STREAM
+            and size and size >= PARALLEL_MIN_SIZE
+            and info.get("accepts_ranges")
+            and not is_video_file(filename)
+        ):
+            return None, filename, False, info
+        
+        # Pick how a >2GB file gets sent now: splitting a video needs room for
+        # its parts next to the original, raw volumes are read straight from it
+        split_video = bool(size and size > TELEGRAM_UPLOAD_LIMIT and is_video_file(filename))
+        if size:
+            await status.edit(f"💾 Waiting for {get_readable_file_size(size)} of disk space")
+            reserved.add(download_path)
+            if split_video and not await url_disk_space.reserve(download_path, 2 * size):
+                split_video = False
+            if not split_video and not await url_disk_space.reserve(download_path, size):
+                await release(download_path)
+                await message.reply(
+                    f"❌ **Not enough disk space for file {i}:** {filename} "
+                    f"is {get_readable_file_size(size)}, only "
+                    f"{get_readable_file_size(max(url_disk_space.available(), 0))} free"
+                )
+                return None
+        
+        async def on_state(gid, state):
+            status.gid = gid
+            if state != "active":
+                await status.edit(ARIA2_STATES[state])
+        
+        # Download with aria2c
+        success, result = await aria2c_download(
+            url,
+            download_path,
+            progress=Leaves.progress_for_pyrogram,
+            progress_args=progressArgs(f"📥 {filename}", status, time()),
+            on_state=on_state
+        )
+        status.gid = None  # No longer in aria2, nothing left to pause
+        
+        if not success:
+            await release(download_path)
+            await message.reply(f"❌ **Failed to download file {i}:**\n{result}")
+            return None
+        
+        LOGGER(__name__).info(f"Downloaded file size: {get_readable_file_size(os.path.getsize(result))}")
+        if not size:
+            split_video = is_video_file(result)
+        return result, filename, split_video, None
     
-    for i, url in enumerate(urls, 1):
+    async def upload(downloaded, status):
+        result, filename, split_video, stream_info = downloaded
+        if stream_info:
+            await _upload_url_stream(bot, message, stream_info, filename, f"**{filename}**", status)
+            return
         try:
-            await progress_message.edit(f"**📥 Downloading file {i}/{len(urls)}...**\n{url[:50]}...")
-            
-            # Generate unique filename
-            import datetime
-            from urllib.parse import urlparse, unquote
-            from helpers.downloaders import is_video_file  # Import the new function
-            
-            parsed_url = urlparse(url)
-            filename = unquote(os.path.basename(parsed_url.path)) or f"download_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            download_path = get_download_path(message.id, filename)
-            
-            # Download with aria2c
-            success, result = await aria2c_download(url, download_path)
-            
-            if not success:
-                await message.reply(f"❌ **Failed to download file {i}:**\n{result}")
-                continue
-            
-            file_size = os.path.getsize(result)
-            LOGGER(__name__).info(f"Downloaded file size: {get_readable_file_size(file_size)}")
-            
-            # Use filename as caption
-            caption = f"**{filename}**"
-            
-            # Check if it's a video file (including MP4)
-            is_video = is_video_file(result)
-            
-            # Check if file needs splitting (>2GB)
-            if file_size > 2 * 1024 * 1024 * 1024:
-                if is_video:
-                    # Use video splitting for video files
-                    await progress_message.edit(f"**✂️ Video >2GB, splitting...**")
-                    
-                    from helpers.utils import split_large_video, get_media_info, get_video_thumbnail
-                    parts = await split_large_video(result, progress_message)
-                    
-                    if parts:
-                        # Upload each part as video
-                        for j, part_path in enumerate(parts, 1):
-                            await progress_message.edit(f"**📤 Uploading part {j}/{len(parts)}...**")
-                            
-                            duration, _, _ = await get_media_info(part_path)
-                            thumb = await get_video_thumbnail(part_path, duration)
-                            
-                            part_caption = f"**{filename}**\n**Part {j} of {len(parts)}**"
-                            
-                            await message.reply_video(
-                                part_path,
-                                duration=duration,
-                                thumb=thumb,
-                                caption=part_caption,
-                                progress=Leaves.progress_for_pyrogram,
-                                progress_args=progressArgs(
-                                    f"📤 Uploading Part {j}/{len(parts)}",
-                                    progress_message,
-                                    time()
-                                )
-                            )
-                            
-                            cleanup_download(part_path)
-                            if thumb:
-                                cleanup_download(thumb)
-                        
-                        cleanup_download(result)
-                    else:
-                        # If video splitting failed, try 7zip
-                        await progress_message.edit(f"**✂️ Splitting with 7zip...**")
-                        parts = await split_file_p7zip(result, max_size_mb=1900, progress_message=progress_message)
-                        
-                        if parts:
-                            for j, part_path in enumerate(parts, 1):
-                                await progress_message.edit(f"**📤 Uploading part {j}/{len(parts)}...**")
-                                await message.reply_document(
-                                    part_path,
-                                    caption=f"**{filename}**\n**Archive Part {j}/{len(parts)}**\nExtract all parts to get the video.",
-                                    progress=Leaves.progress_for_pyrogram,
-                                    progress_args=progressArgs(f"📤 Part {j}", progress_message, time())
-                                )
-                                cleanup_download(part_path)
-                            cleanup_download(result)
-                        else:
-                            # Upload as is
-                            await _upload_video_or_doc(bot, message, result, filename, progress_message)
+            await upload_file(result, filename, split_video, status)
+        finally:
+            await release(result)
+    
+    async def upload_file(result, filename, split_video, status):
+        file_size = os.path.getsize(result)
+        
+        # Use filename as caption
+        caption = f"**{filename}**"
+        
+        # Check if file needs splitting (>2GB)
+        if file_size > TELEGRAM_UPLOAD_LIMIT:
+            if split_video:
+                # Use video splitting for video files
+                await status.edit(f"✂️ Video >2GB, splitting...")
+                
+                if await _upload_video_parts(message, result, caption, status):
+                    cleanup_download(result)
                 else:
-                    # Non-video file, use 7zip
-                    await progress_message.edit(f"**✂️ File >2GB, splitting with 7zip...**")
-                    parts = await split_file_p7zip(result, max_size_mb=1900, progress_message=progress_message)
-                    
-                    if parts:
-                        for j, part_path in enumerate(parts, 1):
-                            await progress_message.edit(f"**📤 Uploading part {j}/{len(parts)}...**")
-                            await message.reply_document(
-                                part_path,
-                                caption=f"**{filename}**\n**Part {j} of {len(parts)}**",
-                                progress=Leaves.progress_for_pyrogram,
-                                progress_args=progressArgs(f"📤 Part {j}", progress_message, time())
-                            )
-                            cleanup_download(part_path)
-                        cleanup_download(result)
-                    else:
-                        await _upload_video_or_doc(bot, message, result, filename, progress_message)
+                    # If video splitting failed, send raw volumes
+                    await _upload_file_volumes(
+                        message, result, caption, status, "Join all parts to get the video."
+                    )
+                    cleanup_download(result)
             else:
-                # Upload directly with proper type detection
-                await _upload_video_or_doc(bot, message, result, filename, progress_message)
-                
-        except Exception as e:
-            LOGGER(__name__).error(f"Error downloading {url}: {e}")
-            await message.reply(f"❌ **Error with file {i}:** {str(e)}")
+                # Non-video file or no room to split it, send raw volumes
+                await _upload_file_volumes(message, result, caption, status)
+                cleanup_download(result)
+        else:
+            # Upload directly with proper type detection
+            await _upload_video_or_doc(bot, message, result, filename, status)
     
-    await progress_message.delete()
+    try:
+        await _run_url_jobs(
+            message, urls, "⬇️ Aria2c downloads", download, upload, footer=aria2_status
+        )
+    finally:
+        for path in list(reserved):
+            await release(path)
     await message.reply(f"✅ **Completed processing {len(urls)} link(s)**")
 
 @bot.on_message(filters.command("yl") & filters.private)
@@ -255,7 +313,7 @@ async def ytdlp_download_command(bot: Client, message: Message):
             "`/yl URL` or `/yl URL1 URL2 ...`\n\n"
             "Features:\n"
             "• Uses saved cookies (if available)\n"
-            "• aria2c with 16 connections\n"
+            "• Parallel fragment downloads\n"
             "• Auto-split videos >2GB\n"
             "• Uses video title as caption"
         )
@@ -264,150 +322,285 @@ async def ytdlp_download_command(bot: Client, message: Message):
     urls_text = message.text.split(None, 1)[1]
     urls = urls_text.split()
     
-    progress_message = await message.reply("**🔍 Processing video links...**")
+    # Tracked so /killall can stop it along with its yt-dlp processes
+    await track_task(_ytdlp_download_urls(bot, message, urls))
+
+async def _ytdlp_download_urls(bot: Client, message: Message, urls: list):
+    from helpers.downloaders import is_video_file
     
-    for i, url in enumerate(urls, 1):
-        try:
-            await progress_message.edit(f"**📥 Downloading video {i}/{len(urls)}...**\n{url[:50]}...")
-            
-            # Generate unique filename (will be updated after download)
-            import datetime
-            temp_filename = f"video_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.mp4"
-            download_path = get_download_path(message.id, temp_filename)
-            
-            # Download with yt-dlp (now returns 3 values: success, path, title)
-            success, result, video_title = await ytdlp_download(url, download_path, use_aria2c=True, progress_message=progress_message)
-            
-            if not success:
-                await message.reply(f"❌ **Failed to download video {i}:**\n{result}")
-                continue
-            
-            # Get actual filename from downloaded file
-            actual_filename = os.path.basename(result)
-            file_size = os.path.getsize(result)
-            LOGGER(__name__).info(f"Downloaded video: {actual_filename}, size: {get_readable_file_size(file_size)}")
-            
-            # Use video title as caption, fallback to filename if no title
-            if video_title:
-                caption = f"**{video_title}**"
-                LOGGER(__name__).info(f"Using video title as caption: {video_title}")
-            else:
-                caption = f"**{actual_filename}**"
-                LOGGER(__name__).info(f"No title found, using filename as caption: {actual_filename}")
-            
-            # Check if it's a video file
-            from helpers.downloaders import is_video_file
-            is_video = is_video_file(result)
-            
-            # Check if file needs splitting (>2GB)
-            if file_size > 2 * 1024 * 1024 * 1024:
-                if is_video:
-                    # Use video splitting method
-                    await progress_message.edit(f"**✂️ Video >2GB, splitting...**")
-                    
-                    from helpers.utils import split_large_video
-                    parts = await split_large_video(result, progress_message)
-                    
-                    if parts:
-                        # Upload each part as video
-                        for j, part_path in enumerate(parts, 1):
-                            await progress_message.edit(f"**📤 Uploading part {j}/{len(parts)}...**")
-                            
-                            # Get video info
-                            from helpers.utils import get_media_info, get_video_thumbnail
-                            duration, _, _ = await get_media_info(part_path)
-                            thumb = await get_video_thumbnail(part_path, duration)
-                            
-                            # Include title in part caption
-                            if video_title:
-                                part_caption = f"**{video_title}**\n**Part {j} of {len(parts)}**"
-                            else:
-                                part_caption = f"**{actual_filename}**\n**Part {j} of {len(parts)}**"
-                            
-                            await message.reply_video(
-                                part_path,
-                                duration=duration,
-                                thumb=thumb,
-                                caption=part_caption,
-                                progress=Leaves.progress_for_pyrogram,
-                                progress_args=progressArgs(
-                                    f"📤 Uploading Part {j}/{len(parts)}",
-                                    progress_message,
-                                    time()
-                                )
-                            )
-                            
-                            cleanup_download(part_path)
-                            if thumb:
-                                cleanup_download(thumb)
-                        
-                        cleanup_download(result)
-                    else:
-                        # If video splitting failed, try 7zip
-                        await progress_message.edit(f"**✂️ Splitting with 7zip...**")
-                        parts = await split_file_p7zip(result, max_size_mb=1900, progress_message=progress_message)
-                        
-                        if parts:
-                            for j, part_path in enumerate(parts, 1):
-                                await progress_message.edit(f"**📤 Uploading part {j}/{len(parts)}...**")
-                                
-                                # Use title in archive caption
-                                if video_title:
-                                    archive_caption = f"**{video_title}**\n**Video Archive Part {j}/{len(parts)}**\nExtract all parts to get the video."
-                                else:
-                                    archive_caption = f"**{actual_filename}**\n**Video Archive Part {j}/{len(parts)}**\nExtract all parts to get the video."
-                                
-                                await message.reply_document(
-                                    part_path,
-                                    caption=archive_caption,
-                                    progress=Leaves.progress_for_pyrogram,
-                                    progress_args=progressArgs(f"📤 Part {j}", progress_message, time())
-                                )
-                                cleanup_download(part_path)
-                            cleanup_download(result)
-                        else:
-                            # Upload as is with title
-                            await _upload_video_or_doc_with_caption(bot, message, result, caption, progress_message)
+    async def download(i, url, status):
+        # Generate unique filename (will be updated after download)
+        import datetime
+        temp_filename = f"video_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.mp4"
+        # Every link gets its own folder, so equal timestamps can't collide
+        download_path = get_download_path(f"{message.id}_{i}", temp_filename)
+        
+        # Download with yt-dlp (now returns 3 values: success, path, title)
+        await status.edit("**📥 Downloading with yt-dlp...**")
+        success, result, video_title = await ytdlp_download(
+            url,
+            download_path,
+            progress=Leaves.progress_for_pyrogram,
+            progress_args=progressArgs(f"📥 {url[:40]}", status, time())
+        )
+        
+        if not success:
+            await message.reply(f"❌ **Failed to download video {i}:**\n{result}")
+            return None
+        
+        LOGGER(__name__).info(f"Downloaded video: {os.path.basename(result)}, size: {get_readable_file_size(os.path.getsize(result))}")
+        return result, video_title
+    
+    async def upload(downloaded, status):
+        result, video_title = downloaded
+        
+        # Get actual filename from downloaded file
+        actual_filename = os.path.basename(result)
+        file_size = os.path.getsize(result)
+        
+        # Use video title as caption, fallback to filename if no title
+        if video_title:
+            caption = f"**{video_title}**"
+            LOGGER(__name__).info(f"Using video title as caption: {video_title}")
+        else:
+            caption = f"**{actual_filename}**"
+            LOGGER(__name__).info(f"No title found, using filename as caption: {actual_filename}")
+        
+        # Check if file needs splitting (>2GB)
+        if file_size > TELEGRAM_UPLOAD_LIMIT:
+            if is_video_file(result):
+                # Use video splitting method
+                await status.edit(f"✂️ Video >2GB, splitting...")
+                
+                # Include title in part caption
+                if await _upload_video_parts(message, result, caption, status):
+                    cleanup_download(result)
                 else:
-                    # Non-video file, use 7zip
-                    await progress_message.edit(f"**✂️ File >2GB, splitting with 7zip...**")
-                    parts = await split_file_p7zip(result, max_size_mb=1900, progress_message=progress_message)
-                    
-                    if parts:
-                        for j, part_path in enumerate(parts, 1):
-                            await progress_message.edit(f"**📤 Uploading part {j}/{len(parts)}...**")
-                            
-                            # Use title for non-video parts too
-                            if video_title:
-                                part_caption = f"**{video_title}**\n**Part {j} of {len(parts)}**"
-                            else:
-                                part_caption = f"**{actual_filename}**\n**Part {j} of {len(parts)}**"
-                            
-                            await message.reply_document(
-                                part_path,
-                                caption=part_caption,
-                                progress=Leaves.progress_for_pyrogram,
-                                progress_args=progressArgs(f"📤 Part {j}", progress_message, time())
-                            )
-                            cleanup_download(part_path)
-                        cleanup_download(result)
-                    else:
-                        await _upload_video_or_doc_with_caption(bot, message, result, caption, progress_message)
+                    # If video splitting failed, send raw volumes with the title
+                    await _upload_file_volumes(
+                        message, result, caption, status, "Join all parts to get the video."
+                    )
+                    cleanup_download(result)
             else:
-                # Upload directly with title as caption
-                await _upload_video_or_doc_with_caption(bot, message, result, caption, progress_message)
-                
+                # Non-video file, send raw volumes
+                await _upload_file_volumes(message, result, caption, status)
+                cleanup_download(result)
+        else:
+            # Upload directly with title as caption
+            await _upload_video_or_doc_with_caption(bot, message, result, caption, status)
+    
+    await _run_url_jobs(message, urls, "📹 yt-dlp downloads", download, upload)
+    await message.reply(f"✅ **Completed processing {len(urls)} video(s)**")
+
+ARIA2_STATES = {"waiting": "⏳ Queued in aria2", "paused": "⏸️ Paused"}
+
+async def aria2_status() -> str:
+    """One line of the daemon's global speed and queue, empty while it isn't running"""
+    try:
+        stats = await aria2_daemon.stats()
+    except Exception as e:
+        LOGGER(__name__).warning(f"aria2 stats failed: {e}")
+        return ""
+    if not stats:
+        return ""
+    return (
+        f"⚡ aria2: {stats.download_speed_string()} | "
+        f"{stats.num_active} active, {stats.num_waiting} waiting"
+    )
+
+@bot.on_message(filters.command(["pause", "resume"]) & filters.private)
+async def aria2_pause_command(_, message: Message):
+    """Pause or resume an aria2 download by the id shown in its /l status"""
+    command = message.command[0]
+    if len(message.command) < 2:
+        await message.reply(f"**Usage:** `/{command} GID`")
+        return
+    
+    gid = message.command[1]
+    try:
+        if command == "pause":
+            await aria2_daemon.pause(gid)
+        else:
+            await aria2_daemon.resume(gid)
+    except Exception as e:
+        await message.reply(f"❌ **Could not {command} `{gid}`:** {e}")
+        return
+    await message.reply(f"✅ **{'Paused' if command == 'pause' else 'Resumed'}** `{gid}`")
+
+class UrlStatus:
+    """
+    One line of an aggregated status message
+    Has the edit() of a Message, so progress callbacks and helpers can write to it
+    """
+    def __init__(self):
+        self.text = "⏳ Queued"
+        self.gid = None  # aria2 download id, for /pause and /resume
+    
+    async def edit(self, text="", **kwargs):
+        # Progress bars span several lines, fold them into one
+        self.text = " ".join(line.strip() for line in text.splitlines() if line.strip())[:200]
+
+async def _run_url_jobs(message: Message, urls: list, title: str, download, upload, footer=None):
+    """
+    Run every URL through download(i, url, status) and then upload(result, status)
+    download returns None when it failed and already told the user why
+    Downloads and uploads have their own concurrency limits; all URLs share one
+    status message with a line each, plus whatever the async footer() returns
+    """
+    statuses = [UrlStatus() for _ in urls]
+    status_message = await message.reply(f"**{title}**")
+    
+    def render(footer_text):
+        lines = [f"**{title}**", ""]
+        for i, (url, status) in enumerate(zip(urls, statuses), 1):
+            gid = f" | GID `{status.gid}`" if status.gid else ""
+            lines.append(f"**{i}.** `{url[:40]}`{gid}\n{status.text}")
+        if footer_text:
+            lines += ["", footer_text]
+        return "\n".join(lines)[:4096]
+    
+    async def refresh():
+        shown = None
+        while True:
+            text = render(await footer() if footer else "")
+            if text != shown:
+                try:
+                    await status_message.edit(text)
+                    shown = text
+                except Exception as e:
+                    LOGGER(__name__).warning(f"Status update failed: {e}")
+            await asyncio.sleep(5)  # Stay well under Telegram's edit rate limit
+    
+    download_slots = asyncio.Semaphore(PyroConf.URL_DOWNLOAD_CONCURRENCY)
+    upload_slots = asyncio.Semaphore(PyroConf.URL_UPLOAD_CONCURRENCY)
+    
+    async def process(i, url, status):
+        try:
+            async with download_slots:
+                result = await download(i, url, status)
+                if result is None:
+                    status.text = "❌ Download failed"
+                    return
+                status.text = "⏳ Waiting to upload"
+                # The download slot is only freed once the upload starts,
+                # so finished files can't pile up on disk
+                await upload_slots.acquire()
+            try:
+                await upload(result, status)
+            finally:
+                upload_slots.release()
+            status.text = "✅ Done"
         except Exception as e:
             LOGGER(__name__).error(f"Error downloading {url}: {e}")
-            await message.reply(f"❌ **Error with video {i}:** {str(e)}")
+            status.text = f"❌ {e}"[:200]
+            await message.reply(f"❌ **Error with link {i}:** {str(e)}")
     
-    await progress_message.delete()
-    await message.reply(f"✅ **Completed processing {len(urls)} video(s)**")
+    refresher = asyncio.create_task(refresh())
+    try:
+        await asyncio.gather(
+            *(process(i, url, status) for i, (url, status) in enumerate(zip(urls, statuses), 1))
+        )
+    finally:
+        refresher.cancel()
+    
+    await status_message.delete()
+
+async def _upload_video_parts(message, file_path, caption, progress_message) -> bool:
+    """
+    Upload a >2GB video part by part while the splitter cuts the next part
+    Returns False if splitting failed before any part was produced
+    """
+    uploaded = 0
+    try:
+        async with aclosing(iter_split_video(file_path, progress_message)) as parts:
+            async for j, total, part_path in parts:
+                await progress_message.edit(f"**📤 Uploading part {j}/{total}...**")
+                
+                thumb = None
+                try:
+                    info = await probe_media(part_path)
+                    thumb = await get_video_thumbnail(part_path, info["duration"])
+                    
+                    await message.reply_video(
+                        part_path,
+                        duration=info["duration"],
+                        width=info["width"],
+                        height=info["height"],
+                        thumb=thumb,
+                        caption=get_part_caption(caption, j, total),
+                        progress=Leaves.progress_for_pyrogram,
+                        progress_args=progressArgs(
+                            f"📤 Uploading Part {j}/{total}",
+                            progress_message,
+                            time()
+                        )
+                    )
+                finally:
+                    # Each part goes away as soon as it is sent, or fails to be
+                    cleanup_download(part_path)
+                    if thumb:
+                        cleanup_download(thumb)
+                uploaded += 1
+    except RuntimeError as e:
+        if uploaded:
+            raise
+        LOGGER(__name__).error(f"Video split failed: {e}")
+        return False
+    
+    return True
+
+async def _upload_file_volumes(message, file_path, caption, progress_message, note=None):
+    """
+    Upload a >2GB file as raw .001, .002, ... volumes read in place from the original
+    They join back with `cat name.0* > name` or by opening the .001 with 7-Zip
+    """
+    file_size = os.path.getsize(file_path)
+    file_name = os.path.basename(file_path)
+    total = (file_size + VOLUME_SIZE - 1) // VOLUME_SIZE
+    
+    for j in range(1, total + 1):
+        offset = (j - 1) * VOLUME_SIZE
+        await progress_message.edit(f"**📤 Uploading part {j}/{total}...**")
+        
+        part_caption = f"{caption}\n**Part {j} of {total}**"
+        if note:
+            part_caption += f"\n{note}"
+        
+        with FileRange(file_path, offset, min(VOLUME_SIZE, file_size - offset), f"{file_name}.{j:03d}") as part:
+            await message.reply_document(
+                part,
+                file_name=part.name,
+                caption=part_caption,
+                progress=Leaves.progress_for_pyrogram,
+                progress_args=progressArgs(f"📤 Part {j}", progress_message, time())
+            )
+
+async def _upload_url_stream(bot, message, info, file_name, caption, progress_message):
+    """
+    Send a URL as a document, or as raw volumes when over 2GB, fed by parallel
+    range requests through a bounded buffer instead of a file on disk
+    """
+    file_size = info["size"]
+    volume_size = VOLUME_SIZE if file_size > TELEGRAM_UPLOAD_LIMIT else file_size
+    total = (file_size + volume_size - 1) // volume_size
+    peer = await bot.resolve_peer(message.chat.id)
+    
+    async with HttpRangeStream(
+        info["url"], file_size, PyroConf.STREAM_CONNECTIONS, PyroConf.STREAM_BUFFER
+    ) as stream:
+        for j in range(1, total + 1):
+            offset = (j - 1) * volume_size
+            part_name = f"{file_name}.{j:03d}" if total > 1 else file_name
+            part_caption = f"{caption}\n**Part {j} of {total}**" if total > 1 else caption
+            
+            part = StreamRange(stream, offset, min(volume_size, file_size - offset), part_name)
+            file_id = await upload_stream_document(bot, peer, part, progress_message)
+            await message.reply_document(file_id, caption=part_caption)
 
 async def _upload_video_or_doc_with_caption(bot, message, file_path, caption, progress_message):
     """Helper to upload video or document with custom caption"""
     from helpers.downloaders import is_video_file
-    from helpers.utils import get_media_info, get_video_thumbnail
+    from helpers.utils import probe_media, get_video_thumbnail
     
     file_size = os.path.getsize(file_path)
     is_video = is_video_file(file_path)
@@ -415,12 +608,14 @@ async def _upload_video_or_doc_with_caption(bot, message, file_path, caption, pr
     if is_video:
         # Upload as video (streamable)
         await progress_message.edit("**📤 Uploading video...**")
-        duration, _, _ = await get_media_info(file_path)
-        thumb = await get_video_thumbnail(file_path, duration)
+        info = await probe_media(file_path)
+        thumb = await get_video_thumbnail(file_path, info["duration"])
         
         await message.reply_video(
             file_path,
-            duration=duration,
+            duration=info["duration"],
+            width=info["width"],
+            height=info["height"],
             thumb=thumb,
             caption=caption,
             progress=Leaves.progress_for_pyrogram,
@@ -444,7 +639,7 @@ async def _upload_video_or_doc_with_caption(bot, message, file_path, caption, pr
 async def _upload_video_or_doc(bot, message, file_path, filename, progress_message):
     """Helper to upload video or document based on file type - always sends MP4 as video"""
     from helpers.downloaders import is_video_file
-    from helpers.utils import get_media_info, get_video_thumbnail
+    from helpers.utils import probe_media, get_video_thumbnail
     
     file_size = os.path.getsize(file_path)
     is_video = is_video_file(file_path)
@@ -455,12 +650,14 @@ async def _upload_video_or_doc(bot, message, file_path, filename, progress_messa
     if is_video:
         # Upload as video (streamable)
         await progress_message.edit("**📤 Uploading video...**")
-        duration, _, _ = await get_media_info(file_path)
-        thumb = await get_video_thumbnail(file_path, duration)
+        info = await probe_media(file_path)
+        thumb = await get_video_thumbnail(file_path, info["duration"])
         
         await message.reply_video(
             file_path,
-            duration=duration,
+            duration=info["duration"],
+            width=info["width"],
+            height=info["height"],
             thumb=thumb,
             caption=caption,
             progress=Leaves.progress_for_pyrogram,
@@ -509,6 +706,14 @@ async def help_command(_, message: Message):
     )
     await message.reply(help_text, reply_markup=markup, disable_web_page_preview=True)
 
+async def reply_download_error(message: Message, error: Exception):
+    """Report a failed post back to the user"""
+    if isinstance(error, (PeerIdInvalid, BadRequest, KeyError)):
+        await message.reply("**Make sure the user client is part of the chat.**")
+    else:
+        await message.reply(f"**❌ {str(error)}**")
+        LOGGER(__name__).error(error)
+
 async def handle_download(bot: Client, message: Message, post_url: str):
     # Cut off URL at '?' if present
     if "?" in post_url:
@@ -530,6 +735,30 @@ async def handle_download(bot: Client, message: Message, post_url: str):
                 return
         
         LOGGER(__name__).info(f"Downloading media from URL: {post_url}")
+    
+    except Exception as e:
+        await reply_download_error(message, e)
+        return
+    
+    await handle_download_message(bot, message, chat_message)
+
+async def handle_download_message(bot: Client, message: Message, chat_message: Message):
+    """Download and resend an already fetched post, without resolving it again"""
+    staged = await download_post(bot, message, chat_message)
+    if staged:
+        await upload_post(bot, message, staged)
+
+async def download_post(bot: Client, message: Message, chat_message: Message):
+    """
+    First stage of a post: copies, cache hits, albums and text are finished here.
+    Single media is downloaded and returned as a staged dict for upload_post, otherwise None.
+    """
+    message_id = chat_message.id
+    
+    try:
+        # Unprotected sources are copied server-side, nothing touches the disk
+        if await copy_message_to(bot, chat_message, message):
+            return None
         
         if chat_message.document or chat_message.video or chat_message.audio:
             file_size = (
@@ -543,7 +772,7 @@ async def handle_download(bot: Client, message: Message, post_url: str):
             if not await fileSizeLimit(
                 file_size, message, "download", user.me.is_premium
             ):
-                return
+                return None
         
         parsed_caption = await get_parsed_msg(
             chat_message.caption or "", chat_message.caption_entities
@@ -557,8 +786,12 @@ async def handle_download(bot: Client, message: Message, post_url: str):
                 await message.reply(
                     "**Could not extract any valid media from the media group.**"
                 )
-            return
+            return None
         elif chat_message.media:
+            # Media uploaded before is re-sent by file_id, no transfer at all
+            if await send_cached_media(message, chat_message, parsed_caption):
+                return None
+            
             start_time = time()
             progress_message = await message.reply("**📥 Downloading Progress...**")
             
@@ -571,13 +804,33 @@ async def handle_download(bot: Client, message: Message, post_url: str):
             
             download_path = get_download_path(message.id, unique_filename)
             
-            media_path = await chat_message.download(
-                file_name=download_path,
+            # Oversized streamable videos are downloaded by the upload stage,
+            # which splits and uploads them while the download is still running
+            if can_stream_split(chat_message):
+                LOGGER(__name__).info(f"Video will be split while downloading: {download_path}")
+                return {
+                    "chat_message": chat_message,
+                    "media_path": download_path,
+                    "media_type": "video",
+                    "caption": parsed_caption,
+                    "progress_message": progress_message,
+                    "start_time": start_time,
+                    "thumb": await download_source_thumbnail(chat_message),
+                    "stream": True,
+                }
+            
+            media_path = await download_media_file(
+                chat_message,
+                download_path,
                 progress=Leaves.progress_for_pyrogram,
                 progress_args=progressArgs(
                     "📥 Downloading Progress", progress_message, start_time
                 ),
             )
+            # Pyrogram returns None instead of raising when a download fails
+            if not media_path:
+                await progress_message.delete()
+                raise RuntimeError("Download failed")
             
             LOGGER(__name__).info(f"Downloaded media: {media_path}")
             
@@ -591,61 +844,189 @@ async def handle_download(bot: Client, message: Message, post_url: str):
                 else "document"
             )
             
-            # Check if video is larger than 2GB and split if needed
-            if media_type == "video" and os.path.getsize(media_path) > 2 * 1024 * 1024 * 1024:
-                LOGGER(__name__).info(f"Video file is larger than 2GB, splitting...")
-                await progress_message.edit("**✂️ Splitting large video...**")
-                
-                split_paths = await split_large_video(media_path, progress_message)
-                if split_paths:
-                    # Upload each part
-                    for i, part_path in enumerate(split_paths, 1):
-                        part_caption = f"{parsed_caption or ''}\n**Part {i} of {len(split_paths)}**" if parsed_caption else f"**Part {i} of {len(split_paths)}**"
-                        await send_media(
-                            bot,
-                            message,
-                            part_path,
-                            media_type,
-                            part_caption,
-                            progress_message,
-                            start_time,
-                        )
-                        cleanup_download(part_path)
-                else:
-                    # Fallback to original file if splitting failed
-                    await send_media(
-                        bot,
-                        message,
-                        media_path,
-                        media_type,
-                        parsed_caption,
-                        progress_message,
-                        start_time,
-                    )
-            else:
-                await send_media(
+            return {
+                "chat_message": chat_message,
+                "media_path": media_path,
+                "media_type": media_type,
+                "caption": parsed_caption,
+                "progress_message": progress_message,
+                "start_time": start_time,
+                # Fetched here, on the user client, so uploads never wait behind downloads for it
+                "thumb": await download_source_thumbnail(chat_message),
+            }
+        elif chat_message.text or chat_message.caption:
+            await message.reply(parsed_text or parsed_caption)
+        else:
+            await message.reply("**No media or text found in the post URL.**")
+    
+    except Exception as e:
+        await reply_download_error(message, e)
+    
+    return None
+
+async def upload_split_parts(
+    bot, message, parts, media_type, caption, progress_message, start_time, sent_files: list
+):
+    """
+    Upload every (index, total, path) part an async iterator yields, in order
+    Sent files are appended to sent_files as they go, so a caller catching an error
+    still knows what reached the user; each part is removed once it is sent or fails
+    """
+    async with aclosing(parts):
+        async for i, total, part_path in parts:
+            part_caption = get_part_caption(caption, i, total)
+            try:
+                sent = await send_media(
                     bot,
                     message,
-                    media_path,
+                    part_path,
+                    media_type,
+                    part_caption,
+                    progress_message,
+                    start_time,
+                )
+            finally:
+                # A yielded part is ours to remove, sent or not
+                cleanup_download(part_path)
+            sent_files.append(get_sent_file(sent))
+
+async def upload_post(bot: Client, message: Message, staged: dict):
+    """Second stage of a post: split if needed, upload, cache and clean up a staged download"""
+    chat_message = staged["chat_message"]
+    media_path = staged["media_path"]
+    media_type = staged["media_type"]
+    parsed_caption = staged["caption"]
+    progress_message = staged["progress_message"]
+    start_time = staged["start_time"]
+    download_task = None
+    
+    try:
+        sent_files = []  # (media_type, file_id) of every uploaded part
+        
+        if staged.get("stream"):
+            video = chat_message.video
+            await progress_message.edit("**📥 Downloading and splitting large video...**")
+            
+            # Parts are cut from the growing file and uploaded as they appear
+            download_task = asyncio.create_task(
+                download_media_file(chat_message, media_path, sequential=True)
+            )
+            try:
+                await upload_split_parts(
+                    bot,
+                    message,
+                    iter_stream_split_video(
+                        media_path, download_task, video.file_size, video.duration, progress_message
+                    ),
                     media_type,
                     parsed_caption,
                     progress_message,
                     start_time,
+                    sent_files,
                 )
+            except RuntimeError as e:
+                if sent_files:
+                    raise
+                LOGGER(__name__).error(f"Stream split failed, waiting for the full download: {e}")
             
-            cleanup_download(media_path)
-            await progress_message.delete()
-        elif chat_message.text or chat_message.caption:
-            await message.reply(parsed_text or parsed_caption)
+            # Pyrogram returns None instead of raising when a download fails
+            if not await download_task:
+                raise RuntimeError("Download failed")
+        
+        if sent_files:
+            pass  # Already uploaded while downloading
+        # Check if video is larger than 2GB and split if needed
+        elif media_type == "video" and os.path.getsize(media_path) > TELEGRAM_UPLOAD_LIMIT:
+            LOGGER(__name__).info(f"Video file is larger than 2GB, splitting...")
+            await progress_message.edit("**✂️ Splitting large video...**")
+            
+            try:
+                # Upload each part while the next one is being cut
+                await upload_split_parts(
+                    bot,
+                    message,
+                    iter_split_video(media_path, progress_message),
+                    media_type,
+                    parsed_caption,
+                    progress_message,
+                    start_time,
+                    sent_files,
+                )
+            except RuntimeError as e:
+                # Parts already sent can't be taken back, only fall back before the first one
+                if sent_files:
+                    raise
+                LOGGER(__name__).error(f"Video split failed: {e}")
+            
+            if not sent_files:
+                # Fallback to original file if splitting failed
+                sent = await send_media(
+                    bot,
+                    message,
+                    media_path,
+                    media_type,
+                    parsed_caption,
+                    progress_message,
+                    start_time,
+                    source=chat_message,
+                    thumb=staged.get("thumb"),
+                )
+                sent_files.append(get_sent_file(sent))
         else:
-            await message.reply("**No media or text found in the post URL.**")
+            sent = await send_media(
+                bot,
+                message,
+                media_path,
+                media_type,
+                parsed_caption,
+                progress_message,
+                start_time,
+                source=chat_message,
+                thumb=staged.get("thumb"),
+            )
+            sent_files.append(get_sent_file(sent))
+        
+        remember_sent_media(get_source_media(chat_message), sent_files)
+        await progress_message.delete()
     
-    except (PeerIdInvalid, BadRequest, KeyError):
-        await message.reply("**Make sure the user client is part of the chat.**")
     except Exception as e:
-        error_message = f"**❌ {str(e)}**"
-        await message.reply(error_message)
-        LOGGER(__name__).error(e)
+        await reply_download_error(message, e)
+    finally:
+        if download_task and not download_task.done():
+            download_task.cancel()
+            await asyncio.gather(download_task, return_exceptions=True)
+        cleanup_download(media_path)
+        if staged.get("thumb"):
+            cleanup_download(staged["thumb"])
+
+async def estimate_staged_size(chat_message) -> int:
+    """Bytes a post may put in downloads/ while it is processed"""
+    messages = [chat_message]
+    if chat_message.media_group_id:
+        # The whole album is downloaded in one go
+        try:
+            messages = await chat_message.get_media_group()
+        except Exception as e:
+            LOGGER(__name__).warning(f"Could not size media group {chat_message.media_group_id}: {e}")
+    
+    total = 0
+    for msg in messages:
+        size = getattr(get_source_media(msg), "file_size", 0) or 0
+        # An oversized video sits on disk next to its split parts
+        if msg.video and size > TELEGRAM_UPLOAD_LIMIT:
+            size *= 2
+        total += size
+    return total
+
+async def discard_staged_post(staged: dict):
+    """Drop a downloaded post that will never be uploaded"""
+    cleanup_download(staged["media_path"])
+    if staged.get("thumb"):
+        cleanup_download(staged["thumb"])
+    try:
+        await staged["progress_message"].delete()
+    except Exception:
+        pass
 
 def message_belongs_to_topic(message, topic_id: int) -> bool:
     """Check if a message belongs to a specific forum topic"""
@@ -748,72 +1129,184 @@ async def download_range(bot: Client, message: Message):
     not_in_topic = []
     processed_media_groups = set()  # Track processed media group IDs
     media_group_skipped = []  # Track message IDs skipped due to media group
+    cancelled = False
     
-    for msg_id in message_ids:
-        url = f"{prefix}/{msg_id}"
-        try:
-            # Get message normally (no message_thread_id parameter)
-            chat_msg = await user.get_messages(chat_id=start_chat, message_ids=msg_id)
-            
-            if not chat_msg or chat_msg.empty:
-                deleted_messages.append(msg_id)
-                skipped += 1
+    worker_count = min(PyroConf.BATCH_CONCURRENCY, len(message_ids))
+    
+    # Posts that passed filtering, streamed from the fetcher to the workers
+    post_queue = asyncio.Queue(maxsize=worker_count * 2)
+    
+    async def fetch_posts():
+        nonlocal skipped, failed
+        
+        # Fetch metadata in chunks through the list form of get_messages
+        for offset in range(0, len(message_ids), MESSAGES_FETCH_LIMIT):
+            chunk_ids = message_ids[offset:offset + MESSAGES_FETCH_LIMIT]
+            try:
+                chat_msgs = await user.get_messages(chat_id=start_chat, message_ids=chunk_ids)
+            except Exception as e:
+                failed += len(chunk_ids)
+                deleted_messages.extend(chunk_ids)
+                LOGGER(__name__).error(f"Error fetching messages {chunk_ids[0]}–{chunk_ids[-1]}: {e}")
                 continue
             
-            # For forum topics, we already filtered with Telethon, but double-check
-            if start_thread and not message_belongs_to_topic(chat_msg, start_thread):
-                not_in_topic.append(msg_id)
-                skipped += 1
-                continue
+            fetched = {chat_msg.id: chat_msg for chat_msg in chat_msgs if chat_msg}
+            LOGGER(__name__).info(f"Fetched {len(fetched)} messages ({chunk_ids[0]}–{chunk_ids[-1]})")
             
-            # Check if this message is part of a media group
-            if chat_msg.media_group_id:
-                if chat_msg.media_group_id in processed_media_groups:
-                    # This media group was already processed, skip this message
-                    media_group_skipped.append(msg_id)
+            for msg_id in chunk_ids:
+                chat_msg = fetched.get(msg_id)
+                
+                if not chat_msg or chat_msg.empty:
+                    deleted_messages.append(msg_id)
                     skipped += 1
                     continue
-                else:
-                    # Mark this media group as processed
-                    processed_media_groups.add(chat_msg.media_group_id)
-                    LOGGER(__name__).info(f"Processing media group {chat_msg.media_group_id} at message {msg_id}")
+                
+                # For forum topics, we already filtered with Telethon, but double-check
+                if start_thread and not message_belongs_to_topic(chat_msg, start_thread):
+                    not_in_topic.append(msg_id)
+                    skipped += 1
+                    continue
+                
+                # Check if this message is part of a media group
+                if chat_msg.media_group_id:
+                    if chat_msg.media_group_id in processed_media_groups:
+                        # This media group was already processed, skip this message
+                        media_group_skipped.append(msg_id)
+                        skipped += 1
+                        continue
+                    else:
+                        # Mark this media group as processed
+                        processed_media_groups.add(chat_msg.media_group_id)
+                        LOGGER(__name__).info(f"Processing media group {chat_msg.media_group_id} at message {msg_id}")
+                
+                has_media = bool(chat_msg.media_group_id or chat_msg.media)
+                has_text = bool(chat_msg.text or chat_msg.caption)
+                
+                if not (has_media or has_text):
+                    skipped += 1
+                    continue
+                
+                await post_queue.put((msg_id, chat_msg))
+        
+        # One stop marker per worker
+        for _ in range(worker_count):
+            await post_queue.put(None)
+    
+    # Downloaded posts waiting for upload, bounded by prefetch depth and disk budget
+    upload_queue = asyncio.Queue(maxsize=PyroConf.BATCH_PREFETCH)
+    disk_budget = DiskBudget(PyroConf.BATCH_DISK_BUDGET)
+    
+    async def download_worker():
+        nonlocal downloaded, failed, cancelled
+        
+        while not cancelled:
+            item = await post_queue.get()
+            if item is None:
+                return
             
-            has_media = bool(chat_msg.media_group_id or chat_msg.media)
-            has_text = bool(chat_msg.text or chat_msg.caption)
+            msg_id, chat_msg = item
+            url = f"{prefix}/{msg_id}"
+            LOGGER(__name__).info(f"Downloading media from URL: {url}")
             
-            if not (has_media or has_text):
-                skipped += 1
-                continue
+            reserved = await disk_budget.acquire(await estimate_staged_size(chat_msg))
             
-            task = track_task(handle_download(bot, message, url))
+            # The message is already resolved, hand it over without a second fetch
+            task = track_task(download_post(bot, message, chat_msg))
             try:
-                await task
-                downloaded += 1
-                
-                # If this was a media group, log how many files were in it
-                if chat_msg.media_group_id:
-                    try:
-                        media_group_messages = await chat_msg.get_media_group()
-                        LOGGER(__name__).info(f"Media group {chat_msg.media_group_id} contained {len(media_group_messages)} files")
-                    except:
-                        pass
-                        
+                staged = await task
             except asyncio.CancelledError:
-                await loading.delete()
-                return await message.reply(
-                    f"**❌ Batch canceled** after downloading `{downloaded}` posts."
-                )
+                cancelled = True
+                await disk_budget.release(reserved)
+                return
             except Exception as download_e:
                 failed += 1
                 deleted_messages.append(msg_id)
                 LOGGER(__name__).error(f"Error downloading {url}: {download_e}")
-                
-        except Exception as e:
-            failed += 1
-            deleted_messages.append(msg_id)
-            LOGGER(__name__).error(f"Error at {url}: {e}")
+                await disk_budget.release(reserved)
+                continue
+            
+            if staged:
+                # Upload happens in the second stage while we fetch the next post
+                try:
+                    await upload_queue.put((msg_id, staged, reserved))
+                except asyncio.CancelledError:
+                    # Never reached the queue, so the final drain won't see it
+                    cancelled = True
+                    await discard_staged_post(staged)
+                    await disk_budget.release(reserved)
+                    raise
+                continue
+            
+            # Copied, cached, album or text posts are already done at this point
+            await disk_budget.release(reserved)
+            downloaded += 1
+            await asyncio.sleep(PyroConf.BATCH_DELAY)
+    
+    async def upload_worker():
+        nonlocal downloaded, failed, cancelled
         
-        await asyncio.sleep(3)
+        while not cancelled:
+            item = await upload_queue.get()
+            if item is None:
+                return
+            
+            msg_id, staged, reserved = item
+            task = track_task(upload_post(bot, message, staged))
+            try:
+                await task
+                downloaded += 1
+            except asyncio.CancelledError:
+                cancelled = True
+                return
+            except Exception as upload_e:
+                failed += 1
+                deleted_messages.append(msg_id)
+                LOGGER(__name__).error(f"Error uploading {prefix}/{msg_id}: {upload_e}")
+            finally:
+                await disk_budget.release(reserved)
+            
+            await asyncio.sleep(PyroConf.BATCH_DELAY)
+    
+    LOGGER(__name__).info(
+        f"Processing {len(message_ids)} posts with {worker_count} worker(s) per stage, "
+        f"prefetch {PyroConf.BATCH_PREFETCH}, disk budget {get_readable_file_size(PyroConf.BATCH_DISK_BUDGET)}"
+    )
+    
+    async def close_upload_queue():
+        # Uploaders drain what is staged, then stop on their marker
+        await asyncio.wait(downloaders)
+        for _ in range(worker_count):
+            await upload_queue.put(None)
+    
+    fetcher = track_task(fetch_posts())
+    downloaders = [track_task(download_worker()) for _ in range(worker_count)]
+    uploaders = [track_task(upload_worker()) for _ in range(worker_count)]
+    closer = track_task(close_upload_queue())
+    
+    results = await asyncio.gather(*downloaders, *uploaders, return_exceptions=True)
+    
+    # Workers may stop early on cancellation, don't leave the helpers blocked
+    for helper in (fetcher, closer):
+        if not helper.done():
+            helper.cancel()
+    results += await asyncio.gather(fetcher, closer, return_exceptions=True)
+    
+    # Staged downloads that never reached the uploader
+    while not upload_queue.empty():
+        item = upload_queue.get_nowait()
+        if item:
+            await discard_staged_post(item[1])
+    
+    if cancelled or any(isinstance(result, asyncio.CancelledError) for result in results):
+        await loading.delete()
+        return await message.reply(
+            f"**❌ Batch canceled** after downloading `{downloaded}` posts."
+        )
+    
+    # Workers finish out of order, keep the report sorted by message ID
+    deleted_messages.sort()
+    not_in_topic.sort()
+    media_group_skipped.sort()
     
     await loading.delete()
     
@@ -874,6 +1367,9 @@ async def stats(_, message: Message):
         f"**➜ Memory Usage:** `{round(process.memory_info()[0] / 1024**2)} MiB`\n\n"
         f"**➜ Upload:** `{sent}`\n"
         f"**➜ Download:** `{recv}`\n\n"
+        f"**➜ File Cache:** `{file_id_cache.count()}` files | "
+        f"`{file_id_cache.hits}` hits | `{file_id_cache.misses}` misses\n"
+        f"**➜ Media Jobs:**\n`{media_scheduler.stats()}`\n\n"
         f"**➜ CPU:** `{cpuUsage}%` | "
         f"**➜ RAM:** `{memory}%` | "
         f"**➜ DISK:** `{disk}%`"
@@ -889,12 +1385,22 @@ async def logs(_, message: Message):
 
 @bot.on_message(filters.command("killall") & filters.private)
 async def cancel_all_tasks(_, message: Message):
-    cancelled = 0
+    cancelled = []
     for task in list(RUNNING_TASKS):
         if not task.done():
             task.cancel()
-            cancelled += 1
-    await message.reply(f"**Cancelled {cancelled} running task(s).**")
+            cancelled.append(task)
+    
+    # Cancelled tasks stop their own child processes; give them the grace period,
+    # then stop whatever is still running
+    if cancelled:
+        await asyncio.wait(cancelled, timeout=TERMINATE_GRACE + 1)
+    stopped = await terminate_all_processes()
+    
+    text = f"**Cancelled {len(cancelled)} running task(s).**"
+    if stopped:
+        text += f"\n**Stopped {stopped} leftover process(es).**"
+    await message.reply(text)
 
 if __name__ == "__main__":
     try: